@@ -2,23 +2,19 @@
 
 import os
 import sys
-import zipfile
-import hashlib
-import shutil
-import yaml
-import json
-import re
 import toml
 import locale
-from PIL import Image
 from PyQt5.QtWidgets import (
-    QFrame, QApplication, QWidget, QPushButton, QLabel, QLineEdit, QTextEdit,QSpacerItem,QSizePolicy,
-    QFileDialog, QComboBox, QSlider, QHBoxLayout, QVBoxLayout, QGridLayout,
-    QMessageBox
+    QFrame, QApplication, QWidget, QPushButton, QLabel, QLineEdit, QSpacerItem,QSizePolicy,
+    QFileDialog, QComboBox, QSlider, QHBoxLayout, QVBoxLayout,
+    QMessageBox, QProgressBar
 )
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QPixmap
-from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+import queue
+import multiprocessing
+from pipeline import app_id, pack, export_process
 import io
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 
@@ -47,100 +43,67 @@ lang = {
     "app_name_cannot_be_empty": ["App Name cannot be empty","应用名称不能为空"],
     "title_name_cannot_be_empty": ["Title Name cannot be empty","标题名称不能为空"],
     "converting_please_wait": ["Converting, please wait...","转换中......, 需要几分钟，请耐心等待"],
+    "cancel": ["Cancel","取消"],
+    "cancelled": ["Cancelled","已取消"],
+    "convert_failed": ["Conversion failed","转换失败"],
+    "convert_done": ["Done","转换完成"],
 }
 
-conf_template = {
-    "conf": {
-        "application": "",
-        "defconfig": {"det_thres": 0.3, "nms_thres": 0.6},
-        "infer_isp": {"format": "BG3P", "channel": 3, "width": 864, "height": 486},
-        "fps_limit": 15,
-        "model_info": [{"name": "object-detection-detector", "filename": ""}],
-        "model_attach": {"classes": {"en": [], "zh-CN": [], "zh-TW": []}}
-    }
-}
-
-desc_template = {
-    "desc": {
-        "application_name": ["name", "名字", "名字"],
-        "application_title": ["title", "抬头", "抬頭"],
-        "stream": True,
-        "version": "0.1"
-    }
-}
+class ConvertProcess(QObject):
+    # 解压、转换、打包都在子进程中进行，界面定时读取事件队列；取消时直接结束子进程，内存随之释放
+    event = pyqtSignal(dict)
+    finished = pyqtSignal(dict)  # 最后一个事件: done / error / cancelled
 
-def clean_name(name):
-    name = name.replace("\\n", "\n")
-    name = name.lower()
-    name = re.sub(r'[^a-z0-9]', '_', name)
-    name = re.sub(r'_+', '_', name)
-    return name.strip('_')
-
-def extract_zip(zip_path, output_dir="model_input"):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        zip_ref.extractall(output_dir)
-    return output_dir
-
-def extract_zip_without_top(zip_path, output_dir="model_input"):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-        for member in zip_ref.infolist():
-            # 跳过空的顶层目录
-            parts = member.filename.split('/')
-            if len(parts) > 1:
-                # 去掉顶层目录
-                target_path = os.path.join(output_dir, *parts[1:])
-            else:
-                target_path = os.path.join(output_dir, parts[0])
-
-            if member.is_dir():
-                os.makedirs(target_path, exist_ok=True)
-            else:
-                os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                with zip_ref.open(member) as source, open(target_path, "wb") as target:
-                    target.write(source.read())
-
-    print("解压完成！")
-
-def zip_with_md5(source_dir="model_output/", zip_dir="./", base_name="app"):
-    temp_zip_path = os.path.join(zip_dir, f"{base_name}.zip")
-    with zipfile.ZipFile(temp_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(source_dir):
-            for file in files:
-                abs_path = os.path.join(root, file)
-                rel_path = os.path.relpath(abs_path, source_dir)
-                zipf.write(abs_path, arcname=rel_path)
-    md5_hash = hashlib.md5()
-    with open(temp_zip_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            md5_hash.update(chunk)
-    md5_str = md5_hash.hexdigest()[:4]
-    final_zip_path = os.path.join(zip_dir, f"{base_name}.{md5_str}.zip")
-    shutil.move(temp_zip_path, final_zip_path)
-    print(f"打包完成: {final_zip_path}")
-    return final_zip_path
-
-class ConvertThread(QThread):
-    finished = pyqtSignal()  # 定义信号，执行完毕触发
-
-    def __init__(self, onnx_path, kmodel_path, dataset_path, conf_path, output_zip_file):
+    def __init__(self, conf, kmodel_conf="kmodel_conf.toml"):
         super().__init__()
-        self.onnx_path = onnx_path
-        self.kmodel_path = kmodel_path
-        self.dataset_path = dataset_path
-        self.conf_path = conf_path
-        self.output_zip_file = output_zip_file
-
-    def run(self):
-        import convertor
-        # 耗时操作放在这里
-        convertor.make(self.onnx_path, self.kmodel_path, self.dataset_path, self.conf_path)
-        zip_with_md5(base_name=self.output_zip_file)
-        self.finished.emit()  # 发射信号通知主线程
+        # spawn 在各平台行为一致，也不会把界面线程复制到子进程
+        ctx = multiprocessing.get_context("spawn")
+        self.events = ctx.Queue()
+        self.process = ctx.Process(target=export_process, args=(self.events, conf, kmodel_conf), daemon=True)
+        self.temp_files = []
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.poll)
+
+    def start(self):
+        self.process.start()
+        self.timer.start(100)
+
+    def poll(self):
+        # 先判断进程是否结束再读队列，退出前发出的事件不会漏掉
+        alive = self.process.is_alive()
+        while True:
+            try:
+                ev = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if ev["event"] == "temp":
+                self.temp_files.append(ev["path"])
+            elif ev["event"] in ("done", "error"):
+                self.stop(ev)
+                return
+            else:
+                self.event.emit(ev)
+        if not alive:
+            self.stop({"event": "error", "error": f"exit code {self.process.exitcode}"})
+
+    def cancel(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.stop({"event": "cancelled"})
+
+    def stop(self, ev):
+        self.timer.stop()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        # 被强制结束的子进程来不及删除的临时文件
+        if ev["event"] != "done":
+            for path in self.temp_files:
+                if os.path.exists(path):
+                    os.remove(path)
+        self.events.close()
+        self.finished.emit(ev)
 
 
 class ModelExportApp(QWidget):
@@ -221,6 +184,7 @@ class ModelExportApp(QWidget):
         self.icon_button.clicked.connect(self.select_icon)
         self.icon_preview = QLabel()
         if self._conf["comm"]["icon_file"] and os.path.exists(self._conf["comm"]["icon_file"]):
+            from PIL import Image
             img = Image.open(self._conf["comm"]["icon_file"])
             if img.size != (60, 60):
                 base, ext = os.path.splitext(self._conf["comm"]["icon_file"])
@@ -287,9 +251,21 @@ class ModelExportApp(QWidget):
         btn_layout.addWidget(self.save_btn)
         btn_layout.addWidget(self.export_btn)
         btn_layout.addWidget(self.pack_btn)
+        self.cancel_btn = QPushButton(lang["cancel"][lang_id])
+        self.cancel_btn.clicked.connect(self.cancel_export)
+        self.cancel_btn.hide()
+        btn_layout.addWidget(self.cancel_btn)
         btn_layout.addStretch(1)
         self.main_layout.addLayout(btn_layout)
 
+        # --- 转换进度 ---
+        self.progress_bar = QProgressBar()
+        self.progress_bar.hide()
+        self.status_label = QLabel("")
+        self.main_layout.addWidget(self.progress_bar)
+        self.main_layout.addWidget(self.status_label)
+        self.convert_process = None
+
         # 设置主布局
         self.setLayout(self.main_layout)
 
@@ -348,6 +324,7 @@ class ModelExportApp(QWidget):
     def select_icon(self):
         file, _ = QFileDialog.getOpenFileName(self, lang["select_icon"][lang_id], "", "PNG files (*.png)")
         if file:
+            from PIL import Image
             img = Image.open(file)
             img = img.convert('RGBA')
             if img.size != (60, 60):
@@ -363,7 +340,7 @@ class ModelExportApp(QWidget):
             pixmap = QPixmap(file)
             self.icon_preview.setPixmap(pixmap)
 
-    def save_conf(self):
+    def sync_conf(self):
         self._conf["comm"]["app_name_zh_CN"] = self.app_zh.text()
         self._conf["comm"]["app_name_EN"] = self.app_en.text()
         self._conf["comm"]["app_name_zh_TW"] = self.app_tw.text()
@@ -371,6 +348,10 @@ class ModelExportApp(QWidget):
         self._conf["comm"]["title_name_zh_CN"] = self.title_zh.text()
         self._conf["comm"]["title_name_EN"] = self.title_en.text()
         self._conf["comm"]["title_name_zh_TW"] = self.title_tw.text()
+        self._conf["comm"]["det_threshold"] = self.threshold_slider.value() / 100
+
+    def save_conf(self):
+        self.sync_conf()
 
         with open("app_conf.toml", 'w', encoding='utf-8') as f:
             toml.dump(self._conf, f)
@@ -386,6 +367,7 @@ class ModelExportApp(QWidget):
         self.save_btn.setText(lang["save_config"][lang_id])
         self.export_btn.setText(lang["convert_and_package"][lang_id])
         self.pack_btn.setText(lang["pack_only"][lang_id])
+        self.cancel_btn.setText(lang["cancel"][lang_id])
         self.select_mode_label.setText(lang["select_mode"][lang_id])
         self.user_dir_button.setText(lang["custom_directory"][lang_id])
         self.icon_button.setText(lang["select_icon"][lang_id])
@@ -428,25 +410,8 @@ class ModelExportApp(QWidget):
 
     def export_model(self):
         print(self._conf)
-        if self._conf["comm"]["mode"] == "MindPlus":
-            #制作MindPlus数据目录
-            if os.path.exists("model_input"):
-                shutil.rmtree("model_input")
-            os.makedirs("model_input", exist_ok=True)
-            model_zip = self._conf["mindplus_options"]["model_zip"] 
-            if not model_zip or not os.path.exists(model_zip):
-                print(f"模型包不存在: {model_zip}")
-                return
-            extract_zip(model_zip, "model_input")
-            dataset_zip = self._conf["mindplus_options"]["dataset_zip"] 
-            if not dataset_zip or not os.path.exists(dataset_zip):
-                print(f"数据集包不存在: {dataset_zip}")
-                return
-            #extract_zip_without_top(dataset_zip, "model_input")
-            extract_zip(dataset_zip, "model_input")
-            self.model_dataset_dir = "model_input"
-        else:
-            self.model_dataset_dir = self._conf["user_options"]["user_dir"]
+        if self.convert_process is not None:
+            return
         if not self.app_zh.text() or not self.app_en.text() or not self.app_tw.text():
             print(lang["app_name_cannot_be_empty"][lang_id])
             #弹出对话框
@@ -457,66 +422,67 @@ class ModelExportApp(QWidget):
             #弹出对话框
             QMessageBox.warning(self, "Warning", lang["title_name_cannot_be_empty"][lang_id])
             return
-        
+
+        self.sync_conf()
         self.export_btn.setText(lang["converting_please_wait"][lang_id])
-        self.export_btn.repaint()   # 强制刷新按钮
-        QApplication.processEvents()  # 处理事件队列，刷新界面
-        #读取数据集标签
-        yaml_path = os.path.join(self.model_dataset_dir, "data.yaml")
-        with open(yaml_path, "r", encoding="utf-8") as f:
-            source_config = yaml.safe_load(f)
-        names = source_config.get("names", {})
-        name_list = [names[i] for i in sorted(names.keys())]
-
-        conf_data = conf_template
-        conf_data["conf"]["application"] = "dfrobot_" + clean_name(self.app_en.text())
-        conf_data["conf"]["model_attach"]["classes"]["zh-CN"] = name_list
-        conf_data["conf"]["model_attach"]["classes"]["zh-TW"] = name_list
-        conf_data["conf"]["model_attach"]["classes"]["en"] = name_list
-        conf_data["conf"]["model_info"][0]["filename"] = conf_data["conf"]["application"] + ".kmodel"
-        conf_data["conf"]["defconfig"]["det_thres"] = self.threshold_slider.value() / 100
-
-        os.makedirs("model_output", exist_ok=True)
-        with open("model_output/conf.json", "w", encoding="utf-8") as f:
-            json.dump(conf_data, f, ensure_ascii=False, indent=4)
-
-        desc_data = desc_template
-        desc_data["desc"]["application_name"] = [
-            self.app_en.text().replace("\\n", "\n"), self.app_zh.text().replace("\\n", "\n"), self.app_tw.text().replace("\\n", "\n")
-        ]
-        desc_data["desc"]["application_title"] = [
-            self.title_en.text().replace("\\n", "\n"), self.title_zh.text().replace("\\n", "\n"), self.title_tw.text().replace("\\n", "\n")
-        ]
-        with open("model_output/desc.json", "w", encoding="utf-8") as f:
-            json.dump(desc_data, f, ensure_ascii=False, indent=4)
-
-        icon_file = self._conf["comm"]["icon_file"]
-        if os.path.exists(icon_file):
-            shutil.copy(icon_file, os.path.join("model_output", os.path.basename(icon_file)))
-        # 创建空文件
-        open(f"model_output/app.{conf_data['conf']['application']}", "w").close()
-        dataset_path = os.path.join(self.model_dataset_dir, "images","train")
-        onnx_path = os.path.join(self.model_dataset_dir, "best.onnx")
-        kmodel_path = os.path.join("model_output", conf_data["conf"]["model_info"][0]["filename"])
-        output_zip = conf_data["conf"]["application"]
-
-        self.thread = ConvertThread(onnx_path, kmodel_path, dataset_path, "kmodel_conf.toml", output_zip)
-        self.thread.finished.connect(self.on_conversion_finished)
-        self.thread.start()
+        self.export_btn.setEnabled(False)
+        self.pack_btn.setEnabled(False)
+        self.cancel_btn.show()
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.show()
+        self.status_label.setText("")
+
+        self.convert_process = ConvertProcess(self._conf, "kmodel_conf.toml")
+        self.convert_process.event.connect(self.on_conversion_event)
+        self.convert_process.finished.connect(self.on_conversion_finished)
+        self.convert_process.start()
         print("正在转换")
 
-    def on_conversion_finished(self):
+    def on_conversion_event(self, ev):
+        if ev["event"] == "stage" and ev["state"] == "start":
+            # 阶段开始时先显示为忙碌，收到进度后再显示百分比
+            self.progress_bar.setRange(0, 0)
+            self.status_label.setText(ev["name"])
+        elif ev["event"] == "progress":
+            if ev.get("unit") == "bytes":
+                self.status_label.setText(f"{ev['stage']}: {ev['done'] / 2**20:.1f} MB")
+            elif ev.get("total"):
+                self.progress_bar.setRange(0, ev["total"])
+                self.progress_bar.setValue(ev["done"])
+                self.status_label.setText(f"{ev['stage']}: {ev['done']}/{ev['total']}")
+
+    def cancel_export(self):
+        if self.convert_process is not None:
+            self.convert_process.cancel()
+
+    def on_conversion_finished(self, ev):
+        self.convert_process = None
         self.export_btn.setText(lang["convert_and_package"][lang_id])
-        print("转换完成！")
+        self.export_btn.setEnabled(True)
+        self.pack_btn.setEnabled(True)
+        self.cancel_btn.hide()
+        self.progress_bar.hide()
+        if ev["event"] == "done":
+            self.status_label.setText(f"{lang['convert_done'][lang_id]}: {ev['package']}")
+            print("转换完成！")
+        elif ev["event"] == "cancelled":
+            self.status_label.setText(lang["cancelled"][lang_id])
+        else:
+            self.status_label.setText(f"{lang['convert_failed'][lang_id]}: {ev['error']}")
+            QMessageBox.warning(self, "Warning", f"{lang['convert_failed'][lang_id]}\n{ev['error']}")
+
+    def closeEvent(self, event):
+        self.cancel_export()
+        super().closeEvent(event)
 
     def pack(self):
         # 打包 ZIP
-        conf_data = conf_template
-        conf_data["conf"]["application"] = "dfrobot_" + clean_name(self.app_en.text())
-        zip_with_md5(base_name=conf_data["conf"]["application"])
+        self.sync_conf()
+        pack(app_id(self._conf), "kmodel_conf.toml")
         print("转换完成！")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     language_code = locale.getdefaultlocale()[0]
     print(f"默认语言环境: {language_code}")
     if language_code.startswith("zh_CN"):
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import toml
+
+import stats
+import convertor
+import pipeline
+import kmodel_cache
+
+num_classes = 4
+
+
+def build_onnx(path, size=320):
+    # 小型yolov8结构: conv+SiLU 下采样主干, 三个尺度的检测头拼接成 (1, 4+nc, N)
+    import numpy as np
+    import onnx
+    from onnx import helper, TensorProto, numpy_helper
+
+    rng = np.random.default_rng(0)
+    nodes, inits = [], []
+
+    def conv(x, cin, cout, k, s, name, act=True):
+        w = (rng.standard_normal((cout, cin, k, k)) * (2.0 / (cin * k * k)) ** 0.5).astype(np.float32)
+        b = np.zeros(cout, dtype=np.float32)
+        inits.append(numpy_helper.from_array(w, name + ".w"))
+        inits.append(numpy_helper.from_array(b, name + ".b"))
+        nodes.append(helper.make_node("Conv", [x, name + ".w", name + ".b"], [name + ".conv"],
+                                      kernel_shape=[k, k], strides=[s, s], pads=[k // 2] * 4))
+        if not act:
+            return name + ".conv"
+        nodes.append(helper.make_node("Sigmoid", [name + ".conv"], [name + ".sig"]))
+        nodes.append(helper.make_node("Mul", [name + ".conv", name + ".sig"], [name]))
+        return name
+
+    x = conv("images", 3, 16, 3, 2, "stem")
+    x = conv(x, 16, 32, 3, 2, "down1")
+    y = conv(x, 32, 32, 3, 1, "c2f1")
+    nodes.append(helper.make_node("Add", [x, y], ["res1"]))
+    p3 = conv("res1", 32, 64, 3, 2, "down2")
+    p4 = conv(p3, 64, 96, 3, 2, "down3")
+    p5 = conv(p4, 96, 128, 3, 2, "down4")
+
+    outs = []
+    for name, feat, ch, stride in (("p3", p3, 64, 8), ("p4", p4, 96, 16), ("p5", p5, 128, 32)):
+        h = conv(feat, ch, 64, 3, 1, name + ".head")
+        o = conv(h, 64, 4 + num_classes, 1, 1, name + ".out", act=False)
+        cells = (size // stride) ** 2
+        inits.append(numpy_helper.from_array(np.array([1, 4 + num_classes, cells], dtype=np.int64), name + ".shape"))
+        nodes.append(helper.make_node("Reshape", [o, name + ".shape"], [name + ".flat"]))
+        outs.append(name + ".flat")
+    nodes.append(helper.make_node("Concat", outs, ["output0"], axis=2))
+
+    total = sum((size // s) ** 2 for s in (8, 16, 32))
+    graph = helper.make_graph(
+        nodes, "yolov8_bench",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, [1, 3, size, size])],
+        [helper.make_tensor_value_info("output0", TensorProto.FLOAT, [1, 4 + num_classes, total])],
+        inits)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+
+
+def build_dataset(_dir, count, width, height, seed=0):
+    # 渐变背景+噪声+随机色块，jpg压缩后与真实照片的解码开销相近
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(_dir, exist_ok=True)
+    gx = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    gy = np.linspace(0, 255, height, dtype=np.float32)[:, None, None]
+    for i in range(count):
+        tint = rng.uniform(0.2, 1.0, 3).astype(np.float32)
+        img = (gx * tint + gy * tint[::-1]) / 2
+        img = img + rng.normal(0, 12, (height, width, 1)).astype(np.float32)
+        img = np.clip(img, 0, 255).astype(np.uint8)
+        for _ in range(rng.integers(2, 8)):
+            x0, y0 = int(rng.integers(0, width - 16)), int(rng.integers(0, height - 16))
+            x1 = min(width - 1, x0 + int(rng.integers(16, max(17, width // 3))))
+            y1 = min(height - 1, y0 + int(rng.integers(16, max(17, height // 3))))
+            color = [int(c) for c in rng.integers(0, 256, 3)]
+            cv2.rectangle(img, (x0, y0), (x1, y1), color, -1)
+        cv2.imwrite(os.path.join(_dir, f"img_{i:05d}.jpg"), img)
+
+
+def bench_conf(path, base_conf):
+    # 使用cpu目标、关闭所有缓存，保证每次测的都是完整流程
+    _conf = convertor.load_conf(base_conf)
+    _conf["compile_options"]["target"] = "cpu"
+    _conf["compile_options"]["dump_ir"] = False
+    _conf["compile_options"]["dump_asm"] = False
+    calib_conf = _conf.setdefault("calib_options", {})
+    calib_conf["samples"] = 0
+    calib_conf["tensor_cache"] = False
+    calib_conf["ram_budget_mb"] = 1 << 20
+    _conf.setdefault("cache_options", {})["enable"] = False
+    with open(path, 'w') as f:
+        toml.dump(_conf, f)
+    return _conf
+
+
+def run_case(work, onnx_file, conf_file, _conf, dataset, compile_model):
+    output_dir = os.path.join(work, "model_output")
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+    kmodel = os.path.join(output_dir, "bench.kmodel")
+
+    stats.begin()
+    files = convertor.list_files(dataset)
+    with stats.stage("calib", images=len(files)):
+        calib, _ = convertor.build_calib(files, _conf, dataset)
+    if compile_model:
+        c = convertor.Convertor(onnx_file, kmodel, conf_file, [calib])
+        c.convert()
+        c = None
+    else:
+        with open(kmodel, 'wb') as f:
+            f.write(os.urandom(4 << 20))
+    calib = None
+    with open(os.path.join(output_dir, "conf.json"), 'w') as f:
+        json.dump(pipeline.conf_template, f)
+    package = pipeline.zip_with_md5(output_dir, work, "bench", _conf.get("package_options"))
+    report = stats.save(os.path.join(work, "bench.report.json"))
+    os.remove(package)
+    return report
+
+
+def summarize(reports):
+    # 每个阶段取多次运行的最小值和平均值
+    result = {}
+    for report in reports:
+        for entry in report["stages"]:
+            result.setdefault(entry["name"], []).append(entry)
+    return {
+        name: {
+            "wall_s_min": min(e["wall_s"] for e in entries),
+            "wall_s_mean": round(sum(e["wall_s"] for e in entries) / len(entries), 4),
+            "cpu_s_min": min(e["cpu_s"] for e in entries),
+            "peak_rss_mb_max": max(e["peak_rss_mb"] for e in entries),
+        }
+        for name, entries in result.items()
+    }
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.decode().strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    os.makedirs(args.work_dir, exist_ok=True)
+    conf_file = os.path.join(args.work_dir, "kmodel_conf.toml")
+    _conf = bench_conf(conf_file, args.kmodel_conf)
+    _conf["calib_options"]["workers"] = args.workers
+
+    onnx_file = os.path.join(args.work_dir, "bench.onnx")
+    if not args.no_compile and not os.path.exists(onnx_file):
+        pre = convertor.preprocessor(_conf)
+        assert pre.width == pre.height, print('benchmark model needs a square input_shape')
+        build_onnx(onnx_file, pre.width)
+
+    cases = []
+    for res in args.resolutions.split(","):
+        width, height = (int(v) for v in res.lower().split("x"))
+        for count in (int(v) for v in args.sizes.split(",")):
+            name = f"n{count}_{width}x{height}"
+            dataset = os.path.join(args.work_dir, "datasets", name)
+            if not os.path.exists(dataset):
+                build_dataset(dataset, count, width, height)
+            reports = [run_case(args.work_dir, onnx_file, conf_file, _conf, dataset, not args.no_compile)
+                       for _ in range(args.repeat)]
+            cases.append({"name": name, "images": count, "resolution": [width, height],
+                          "stages": summarize(reports)})
+
+    result = {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "nncase": kmodel_cache.nncase_version(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "workers": args.workers,
+            "repeat": args.repeat,
+            "compile": not args.no_compile,
+        },
+        "cases": cases,
+    }
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=4)
+    print(f"结果: {args.out}")
+
+
+def compare(args):
+    with open(args.base, 'r', encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, 'r', encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"base: {base['meta']['commit']} {base['meta']['nncase']}")
+    print(f"new:  {new['meta']['commit']} {new['meta']['nncase']}")
+    base_cases = {c["name"]: c for c in base["cases"]}
+    for case in new["cases"]:
+        old = base_cases.get(case["name"])
+        if old is None:
+            continue
+        print(case["name"])
+        for name, s in case["stages"].items():
+            if name not in old["stages"]:
+                continue
+            t0, t1 = old["stages"][name]["wall_s_min"], s["wall_s_min"]
+            ratio = t1 / t0 if t0 > 0 else float("inf")
+            print(f"  {name:<12} {t0:9.3f}s -> {t1:9.3f}s  x{ratio:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the conversion pipeline on synthetic data")
+    sub = parser.add_subparsers(dest="cmd")
+    p = sub.add_parser("run")
+    p.add_argument("--sizes", default="16,64", help="images per dataset")
+    p.add_argument("--resolutions", default="640x480,1920x1080")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--workers", type=int, default=0, help="calib_options.workers")
+    p.add_argument("--kmodel-conf", default="kmodel_conf.toml")
+    p.add_argument("--work-dir", default="bench_work")
+    p.add_argument("--no-compile", action="store_true", help="skip nncase, time only preprocessing and packaging")
+    p.add_argument("--out", default="bench.json")
+    p = sub.add_parser("compare")
+    p.add_argument("base")
+    p.add_argument("new")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "run":
+        run(args)
+    elif args.cmd == "compare":
+        compare(args)
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
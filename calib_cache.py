@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import uuid
+import hashlib
+import tempfile
+import contextlib
+import numpy as np
+import zipsource
+
+shard_rows = 512
+
+
+@contextlib.contextmanager
+def locked(path):
+    # 进程间互斥锁，进程异常退出时由系统释放
+    with open(path, 'a+b') as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    # LK_LOCK 重试约 10 秒后抛出 OSError，继续等待
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class CalibCache:
+    # 多个转换(cli.py -j、worker.py -w)可以同时使用同一个缓存目录:
+    # 分片名唯一且写入后不再修改，index.json 在锁内重新读取、合并后原子替换
+    def __init__(self, cache_dir: str, params: str):
+        self.cache_dir = cache_dir
+        self.params = params
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock_path = os.path.join(cache_dir, "index.lock")
+        os.makedirs(cache_dir, exist_ok=True)
+        # 文件key -> 绝对路径，用于清理同一文件的旧版本
+        self.paths = {}
+        self.index = self.read_index()
+
+    def read_index(self):
+        # entries: 文件key -> [分片名, 行号, 绝对路径], shards: 分片名 -> 行数
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                return json.load(f)
+        return {"entries": {}, "shards": {}}
+
+    def file_key(self, path):
+        abs_path = os.path.abspath(path)
+        key = f"{abs_path}|{zipsource.stat_key(path)}|{self.params}"
+        key = hashlib.sha1(key.encode()).hexdigest()
+        self.paths[key] = abs_path
+        return key
+
+    def load_into(self, calib, keys):
+        # 命中的行从memmap分片直接拷入标定张量，返回未命中的序号
+        entries = self.index["entries"]
+        by_shard = {}
+        misses = []
+        for i, key in enumerate(keys):
+            if key in entries:
+                shard, row = entries[key][:2]
+                by_shard.setdefault(shard, []).append((i, row))
+            else:
+                misses.append(i)
+
+        for shard, rows in by_shard.items():
+            try:
+                data = np.load(os.path.join(self.cache_dir, shard), mmap_mode='r')
+            except FileNotFoundError:
+                # 读取索引后被其他转换清理掉了
+                misses.extend(i for i, _ in rows)
+                continue
+            if data.shape[1:] != calib.shape[1:]:
+                misses.extend(i for i, _ in rows)
+                continue
+            for i, row in rows:
+                calib[i] = data[row]
+            del data
+
+        misses.sort()
+        print(f"calib tensor cache: {len(keys) - len(misses)} hit, {len(misses)} miss")
+        return misses
+
+    def _write_shard(self, calib, idx, keys, entries):
+        # 分片名唯一，不会覆盖其他转换正在读取或刚写入的分片
+        name = f"shard_{uuid.uuid4().hex}.npy"
+        np.save(os.path.join(self.cache_dir, name), calib[idx])
+        self.index["shards"][name] = len(idx)
+        for row, i in enumerate(idx):
+            entries[keys[i]] = [name, row, self.paths.get(keys[i], "")]
+
+    def _exists(self, path):
+        return zipsource.exists(path) if zipsource.is_member(path) else os.path.exists(path)
+
+    def update(self, calib, keys, misses):
+        with locked(self.lock_path):
+            # 其他转换可能已经更新了索引，在锁内重新读取后合并
+            self.index = self.read_index()
+            entries = self.index["entries"]
+
+            # 只清理本次文件的旧版本(内容已变化)和已删除的文件，其他转换用到的条目保留
+            current = set(keys)
+            paths = {self.paths[k] for k in keys if k in self.paths}
+            for key, entry in list(entries.items()):
+                path = entry[2] if len(entry) > 2 else ""
+                if key not in current and (not path or path in paths or not self._exists(path)):
+                    del entries[key]
+
+            # 等待锁期间其他转换可能已经写入了同样的行
+            misses = [i for i in misses if keys[i] not in entries]
+            for start in range(0, len(misses), shard_rows):
+                self._write_shard(calib, misses[start:start + shard_rows], keys, entries)
+
+            live = set(entry[0] for entry in entries.values())
+            for shard in list(self.index["shards"]):
+                if shard not in live:
+                    try:
+                        os.remove(os.path.join(self.cache_dir, shard))
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        # Windows 上仍被其他进程映射的分片删不掉，留在索引中下次再删
+                        print(f"calib tensor cache: keep {shard}: {e}")
+                        continue
+                    del self.index["shards"][shard]
+
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self.index, f)
+                os.replace(tmp, self.index_path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp)
+                raise
+
+
+def open_cache(calib_conf, params, dataset):
+    if not calib_conf.get('tensor_cache', False):
+        return None
+    # 每个 (数据集目录, 预处理参数) 单独一个索引: update 会删除索引中本次没用到的分片，
+    # 切换 input_shape 等设置或并行转换不同设置的模型时不会删掉彼此的分片
+    sub = hashlib.sha1(f"{os.path.abspath(dataset)}|{params}".encode()).hexdigest()[:16]
+    return CalibCache(os.path.join(calib_conf.get('tensor_cache_dir', './calib_cache/tensors'), sub), params)
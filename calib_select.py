@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import random
+import tempfile
+import cv2
+import numpy as np
+import zipsource
+from preprocess import imread
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+embed_size = 16
+hash_size = 8
+
+
+def label_path(img_path):
+    # yolo格式: images/train/x.jpg 对应 labels/train/x.txt
+    parts = list(Path(img_path).parts)
+    for i in range(len(parts) - 1, -1, -1):
+        if parts[i] == "images":
+            parts[i] = "labels"
+            return str(Path(*parts).with_suffix(".txt"))
+    return None
+
+
+def read_classes(img_path):
+    path = label_path(img_path)
+    if path is None or not zipsource.exists(path):
+        return set()
+    classes = set()
+    for line in zipsource.read_bytes(path).decode().splitlines():
+        fields = line.split()
+        if fields:
+            classes.add(int(float(fields[0])))
+    return classes
+
+
+def select_random(files, count, rng):
+    return rng.sample(files, count)
+
+
+def select_stratified(files, count, rng):
+    # 按类别分组后轮流抽取，保证少样本的类别也能进入标定集
+    groups = {}
+    for f in files:
+        for c in read_classes(f) or {-1}:
+            groups.setdefault(c, []).append(f)
+    for group in groups.values():
+        rng.shuffle(group)
+
+    chosen = {}
+    queues = [groups[c] for c in sorted(groups)]
+    while len(chosen) < count and any(queues):
+        for group in queues:
+            while group:
+                f = group.pop()
+                if f not in chosen:
+                    chosen[f] = None
+                    break
+            if len(chosen) == count:
+                break
+    return list(chosen)
+
+
+def embed(img_path):
+    img = imread(img_path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    img = cv2.resize(img, (embed_size, embed_size), interpolation=cv2.INTER_AREA)
+    vec = img.astype(np.float32).ravel()
+    vec -= vec.mean()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+def select_diverse(files, count, rng, workers=1):
+    # 缩略图向量上的最远点采样
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        vecs = np.stack(list(executor.map(embed, files)))
+
+    picked = []
+    dist = np.full(len(files), np.inf, dtype=np.float32)
+    i = rng.randrange(len(files))
+    for _ in range(count):
+        picked.append(i)
+        dist = np.minimum(dist, np.linalg.norm(vecs - vecs[i], axis=1))
+        dist[i] = -1
+        i = int(np.argmax(dist))
+    return [files[i] for i in picked]
+
+
+def dhash(img_path):
+    # 差值哈希: 缩成 9x8 灰度图后比较左右相邻像素，得到 64 位
+    img = imread(img_path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    img = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    return np.packbits(img[:, 1:] > img[:, :-1]).tobytes().hex()
+
+
+def load_hashes(files, cache_path, workers=1):
+    # 哈希按 路径|大小|修改时间 缓存，文件没变就不再解码
+    cache = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'r') as f:
+            cache = json.load(f)
+    keys = [f"{os.path.abspath(f)}|{zipsource.stat_key(f)}" for f in files]
+    todo = [i for i, key in enumerate(keys) if key not in cache]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i, h in zip(todo, executor.map(dhash, [files[i] for i in todo])):
+            cache[keys[i]] = h
+
+    if cache_path and todo:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_path)), suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp, cache_path)
+    print(f"dedupe hashes: {len(files) - len(todo)} cached, {len(todo)} computed")
+    return np.frombuffer(bytes.fromhex("".join(cache[key] for key in keys)), dtype=np.uint8).reshape(len(files), -1)
+
+
+def keep_mask(hashes, threshold, block=1024):
+    # 按文件顺序贪心保留: 与已保留的样本汉明距离都超过阈值才保留。
+    # 逐块用矩阵乘法与已保留的样本比较，不生成逐对的列表，大量相邻视频帧时也是线性的块数
+    bits = np.unpackbits(hashes, axis=1).astype(np.float32)
+    limit = threshold + 0.5
+    keep = np.zeros(len(bits), dtype=bool)
+    kept = np.empty_like(bits)
+    count = 0
+    for start in range(0, len(bits), block):
+        chunk = bits[start:start + block]
+        # 1. 与之前各块已保留的样本比较
+        if count:
+            ref = kept[:count]
+            dist = chunk @ (1 - ref).T + (1 - chunk) @ ref.T
+            candidates = np.nonzero(~(dist <= limit).any(1))[0]
+        else:
+            candidates = np.arange(len(chunk))
+        # 2. 块内按顺序贪心，只和块内已保留的比较
+        sub = chunk[candidates]
+        close = (sub @ (1 - sub).T + (1 - sub) @ sub.T) <= limit
+        chosen = np.zeros(len(sub), dtype=bool)
+        for r in range(len(sub)):
+            chosen[r] = not (close[r, :r] & chosen[:r]).any()
+        rows = candidates[chosen]
+        keep[start + rows] = True
+        kept[count:count + len(rows)] = chunk[rows]
+        count += len(rows)
+    return keep
+
+
+def dedupe(files, calib_conf, workers=1):
+    # 去掉近似重复的图片(例如同一段视频的相邻帧)，按文件顺序保留先出现的
+    if not calib_conf.get('dedupe', False) or len(files) < 2:
+        return files
+    hashes = load_hashes(files, calib_conf.get('dedupe_cache', './calib_cache/phash.json'), workers)
+    keep = keep_mask(hashes, int(calib_conf.get('dedupe_threshold', 4)))
+    kept = [f for f, k in zip(files, keep) if k]
+    print(f"calib dedupe: dropped {len(files) - len(kept)}/{len(files)} near-duplicates")
+    return kept
+
+
+def select_files(files, calib_conf, workers=1):
+    count = int(calib_conf.get('samples', 0))
+    method = calib_conf.get('select', 'random')
+    if count <= 0 or count >= len(files):
+        return files
+
+    rng = random.Random(calib_conf.get('seed', 0))
+    if method == "random":
+        chosen = select_random(files, count, rng)
+    elif method == "stratified":
+        chosen = select_stratified(files, count, rng)
+    elif method == "diverse":
+        chosen = select_diverse(files, count, rng, workers)
+    else:
+        raise ValueError(f"unknown select method: {method}")
+    print(f"calib select {method}: {len(chosen)}/{len(files)}")
+    return sorted(chosen)
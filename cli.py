@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import traceback
+import toml
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pipeline
+
+
+def load_jobs(manifest):
+    # 清单可以是 app_conf.toml（单个任务），也可以包含多个 [[jobs]]
+    with open(manifest, 'r', encoding='utf-8') as f:
+        _conf = toml.load(f)
+    base = os.path.dirname(os.path.abspath(manifest))
+
+    jobs = _conf.get("jobs") or [_conf]
+    for job in jobs:
+        job.setdefault("comm", {}).setdefault("mode", "MindPlus")
+        job.setdefault("mindplus_options", {"dataset_zip": "", "model_zip": ""})
+        job.setdefault("user_options", {"user_dir": ""})
+        # 相对路径按清单文件所在目录解析
+        for section, key in (("comm", "icon_file"), ("mindplus_options", "model_zip"),
+                             ("mindplus_options", "dataset_zip"), ("user_options", "user_dir")):
+            value = job[section].get(key, "")
+            if value:
+                job[section][key] = os.path.join(base, value)
+            else:
+                job[section][key] = ""
+        job.setdefault("name", pipeline.app_id(job))
+    return _conf, jobs
+
+
+def run_job(job, kmodel_conf, work_dir, zip_dir, profile=None, clean=True):
+    # clean=False 时保留上次的 build/<name>，只执行输入有变化的阶段
+    start = time.time()
+    job_dir = os.path.join(work_dir, job["name"])
+    if clean and os.path.exists(job_dir):
+        shutil.rmtree(job_dir)
+    try:
+        package = pipeline.export(job, kmodel_conf,
+                                  os.path.join(job_dir, "model_input"),
+                                  os.path.join(job_dir, "model_output"),
+                                  zip_dir, profile)
+        return {"name": job["name"], "ok": True, "package": package,
+                "seconds": round(time.time() - start, 1)}
+    except Exception as e:
+        traceback.print_exc()
+        return {"name": job["name"], "ok": False, "error": f"{type(e).__name__}: {e}",
+                "seconds": round(time.time() - start, 1)}
+
+
+def watched_paths(job):
+    if job["comm"]["mode"] == "MindPlus":
+        paths = [job["mindplus_options"]["model_zip"], job["mindplus_options"]["dataset_zip"]]
+    else:
+        paths = [job["user_options"]["user_dir"]]
+    return paths + [job["comm"]["icon_file"]]
+
+
+def watch(manifest, kmodel_conf, work_dir, zip_dir, interval, profile=None):
+    # 轮询 user_dir/压缩包、图标、清单和 kmodel_conf，有变化的任务增量重建，Ctrl+C 退出
+    import stages
+    last_manifest, last, jobs = None, {}, []
+    print(f"watching {manifest}, Ctrl+C to stop")
+    try:
+        while True:
+            manifest_key = stages.path_key(manifest)
+            if manifest_key != last_manifest:
+                try:
+                    _, jobs = load_jobs(manifest)
+                except (OSError, toml.TomlDecodeError) as e:
+                    # 编辑器保存到一半时解析失败，下次轮询再读
+                    print(f"cannot load {manifest}: {e}")
+                    time.sleep(interval)
+                    continue
+                last_manifest = manifest_key
+            for job in jobs:
+                key = stages.fingerprint([stages.path_key(p) for p in watched_paths(job) if p]
+                                         + [manifest_key, stages.path_key(kmodel_conf)])
+                if last.get(job["name"]) == key:
+                    continue
+                r = run_job(job, kmodel_conf, work_dir, zip_dir, profile, clean=False)
+                print(f"{'OK  ' if r['ok'] else 'FAIL'} {r['name']} ({r['seconds']}s): {r.get('package', r.get('error'))}")
+                last[job["name"]] = key
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert and package models without the GUI")
+    parser.add_argument("manifest", help="app_conf.toml or a manifest with [[jobs]]")
+    parser.add_argument("--kmodel-conf", default=None, help="default: kmodel_conf.toml")
+    parser.add_argument("--work-dir", default=None, help="per-job model_input/model_output, default: ./build")
+    parser.add_argument("--output-dir", default=None, help="where packages are written, default: ./")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="concurrent conversions, default: 1")
+    parser.add_argument("--summary", default=None, help="write the result summary as JSON")
+    parser.add_argument("--profile", choices=["cprofile", "tracemalloc"], default=None,
+                        help="profile each job, saved next to its report")
+    parser.add_argument("--watch", type=float, nargs="?", const=2.0, default=None, metavar="SECONDS",
+                        help="keep running and rebuild incrementally when inputs change, polling every SECONDS")
+    args = parser.parse_args(argv)
+
+    _conf, jobs = load_jobs(args.manifest)
+    kmodel_conf = args.kmodel_conf or _conf.get("kmodel_conf", "kmodel_conf.toml")
+    work_dir = args.work_dir or _conf.get("work_dir", "build")
+    zip_dir = args.output_dir or _conf.get("output_dir", "./")
+    limit = args.jobs or _conf.get("parallel", 1)
+
+    names = [job["name"] for job in jobs]
+    if len(set(names)) != len(names):
+        parser.error("job names must be unique, set name = ... in the manifest")
+    os.makedirs(work_dir, exist_ok=True)
+    os.makedirs(zip_dir, exist_ok=True)
+    if args.watch is not None:
+        return watch(args.manifest, kmodel_conf, work_dir, zip_dir, args.watch, args.profile)
+
+    results = []
+    if limit <= 1:
+        for job in jobs:
+            results.append(run_job(job, kmodel_conf, work_dir, zip_dir, args.profile))
+    else:
+        with ProcessPoolExecutor(max_workers=limit) as executor:
+            futures = [executor.submit(run_job, job, kmodel_conf, work_dir, zip_dir, args.profile) for job in jobs]
+            for fut in as_completed(futures):
+                results.append(fut.result())
+        results.sort(key=lambda r: names.index(r["name"]))
+
+    failed = [r for r in results if not r["ok"]]
+    print(f"\n{len(results) - len(failed)} succeeded, {len(failed)} failed")
+    for r in results:
+        status = r["package"] if r["ok"] else r["error"]
+        print(f"  {'OK  ' if r['ok'] else 'FAIL'} {r['name']} ({r['seconds']}s): {status}")
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
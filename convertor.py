@@ -1,62 +1,100 @@
 #!/usr/bin/env python3
 
-import subprocess
-import argparse
-import nncase
-import toml
-import sys
+import functools
+import contextlib
 import os
-import cv2
-import numpy as np
+import tempfile
+import time
+import itertools
+import kmodel_cache
+import stats
+import zipsource
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+# nncase, cv2, numpy 在开始转换时才导入，保持 import convertor 足够快
 
 swapRB = False
 preprocess = False
 
-input_type = np.uint8
+input_type = "uint8"
+
+
+@functools.lru_cache(maxsize=None)
+def nncase_location():
+    # 等价于 pip show nncase 的 Location 字段
+    from importlib import metadata
+    return str(metadata.distribution("nncase").locate_file(""))
 
-templs_shape = 320
 
+@functools.lru_cache(maxsize=None)
+def load_nncase():
+    # setup env
+    location = nncase_location()
+    if "PATH" in os.environ:
+        os.environ["PATH"] += os.pathsep + location
+    else:
+        os.environ["PATH"] = location
+    os.environ["NNCASE_PLUGIN_PATH"] = location
 
-# setup env
-result = subprocess.run(["pip", "show", "nncase"], capture_output=True)
-line_break = "\n"
-if sys.platform == "win32":
-    line_break = "\r\n"
-location_s = [i for i in result.stdout.decode().split(
-    line_break) if i.startswith("Location:")]
-location = location_s[0].split(": ")[1]
-if "PATH" in os.environ:
-    os.environ["PATH"] += os.pathsep + location
-else:
-    os.environ["PATH"] = location
-os.environ["NNCASE_PLUGIN_PATH"] = location
+    import nncase
+    return nncase
 
 
-class Convertor(nncase.Compiler):
+class Convertor:
     kmodel: str
 
     def __init__(self, model: str, kmodel: str, conf: str, calib: list):
-        _conf: map
-        with open(conf, 'r') as f:
-            _conf = toml.load(f)
-
-        super().__init__(self._set_cpl_opt(_conf))
-        with open(model, 'rb') as f:
-            _model = Path(model)
-            if _model.suffix == ".onnx":
-                self.import_onnx(f.read(), nncase.ImportOptions())
-            else:
-                assert False, print('not support model type')
-        self.use_ptq(self._set_ptq_opt(_conf, calib))
+        nncase = load_nncase()
+        _conf = load_conf(conf)
+
+        _model = Path(model)
+        if _model.suffix != ".onnx":
+            assert False, print('not support model type')
+        if _conf.get('onnx_options', {}).get('optimize', False):
+            import onnx_opt
+            with stats.stage("onnx_opt") as st:
+                model_bytes, st["nodes_before"], st["nodes_after"] = onnx_opt.optimize(
+                    zipsource.read_bytes(model), _conf)
+            model_src = contextlib.nullcontext(model_bytes)
+        elif zipsource.is_member(model):
+            # model 也可以是压缩包内的文件，例如 model.zip/best.onnx
+            model_src = contextlib.nullcontext(zipsource.read_bytes(model))
+        else:
+            # nncase 的绑定通过 readinto/seek/tell 读取流，直接传入打开的文件，不必先读成 bytes
+            model_src = open(model, 'rb')
+
+        with stats.stage("import_onnx"):
+            self.compiler = nncase.Compiler(self._set_cpl_opt(_conf))
+            with model_src as model_content:
+                self.import_onnx(model_content, nncase.ImportOptions())
+        self._conf = _conf
         self.kmodel = kmodel
+        # calib 为 None 时先只导入模型，标定数据准备好后再调用 set_calib
+        if calib is not None:
+            self.set_calib(calib)
+
+    def set_calib(self, calib: list):
+        with stats.stage("ptq_setup"):
+            self.use_ptq(self._set_ptq_opt(self._conf, calib))
+
+    def __getattr__(self, name):
+        # 其余方法转发给 nncase.Compiler
+        if name in ("compiler", "_conf"):
+            raise AttributeError(name)
+        return getattr(self.compiler, name)
 
     def convert(self):
-        self.compile()
-        with open(self.kmodel, 'wb') as f:
-            f.write(self.gencode_tobytes())
+        with stats.stage("compile"):
+            self.compile()
+        with stats.stage("gencode"):
+            # 直接写入文件，不再先生成整个 kmodel 的 bytes
+            with open(self.kmodel, 'wb') as f:
+                self.gencode(f)
+                stats.progress("gencode", f.tell(), unit="bytes")
 
     def _set_cpl_opt(self, conf: map):
+        nncase = load_nncase()
         compile_options = nncase.CompileOptions()
         compile_options.target = conf['compile_options']['target']
         compile_options.dump_ir = conf['compile_options']['dump_ir']
@@ -77,6 +115,7 @@ class Convertor(nncase.Compiler):
         return compile_options
 
     def _set_ptq_opt(self, conf: map, calib: list):
+        nncase = load_nncase()
         ptq_options = nncase.PTQTensorOptions()
         ptq_options.calibrate_method = conf['ptq_options']['calibrate_method']
         ptq_options.finetune_weights_method = conf['ptq_options']['finetune_weights_method']
@@ -97,50 +136,185 @@ class Convertor(nncase.Compiler):
         return ptq_options
 
 
-def padding(img):
-    h, w = img.shape[:2]
+def preprocessor(conf):
+    import preprocess
+    return preprocess.Preprocessor(conf.get('compile_options', {}),
+                                   conf.get('calib_options', {}).get('reduced_decode', False))
 
-    scale = max(w, h)
-    pad_top    = (scale - h) // 2
-    pad_bottom = (scale - h) - pad_top
-    pad_left   = (scale - w) // 2
-    pad_right  = (scale - w) - pad_left
 
-    img = cv2.copyMakeBorder(img, pad_top, pad_bottom, pad_left, pad_right,
-                                    cv2.BORDER_CONSTANT, value=[0, 0, 0])
+def load_conf(conf):
+    import toml
+    with open(conf, 'r') as f:
+        return toml.load(f)
 
-    return img
 
+def list_files(_dir):
+    # _dir 可以是目录，也可以是压缩包内的目录，例如 dataset.zip/images/train
+    if zipsource.is_member(_dir) or str(_dir).lower().endswith(".zip"):
+        return sorted(zipsource.list_files(_dir))
+    path = Path(_dir)
+    return sorted(str(f) for f in path.rglob('*') if f.is_file())
 
-def process_img(img):
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    img = padding(img)
-    #print(img.shape)
-    img = cv2.resize(img, (320, 320))
-    img = np.transpose(img, (2, 0, 1))
-    img = np.expand_dims(img, axis=0)
-    return img
 
+def calib_workers(calib_conf):
+    return int(calib_conf.get('workers', 0)) or os.cpu_count() or 1
+
+
+def imap_index(fn, items, workers, pool="thread"):
+    # 并行执行fn，按完成先后返回(序号, 结果)，在途任务数有上限
+    if workers <= 1:
+        for i, item in enumerate(items):
+            yield i, fn(item)
+        return
+
+    executor_cls = ProcessPoolExecutor if pool == "process" else ThreadPoolExecutor
+    todo = enumerate(items)
+    with executor_cls(max_workers=workers) as executor:
+        pending = {executor.submit(fn, item): i
+                   for i, item in itertools.islice(todo, workers * 4)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                yield pending.pop(fut), fut.result()
+            for i, item in itertools.islice(todo, len(done)):
+                pending[executor.submit(fn, item)] = i
 
-def gen(_dir):
-    path = Path(_dir)
-    files = [f.name for f in path.rglob('*') if f.is_file()]
-    for f in files:
-        img_path = os.path.join(_dir, f)
-        #print(img_path)
-        templ = cv2.imread(img_path)
-        templ = process_img(templ)
-        yield templ
+
+def alloc_calib(count, input_shape, calib_conf):
+    # 预分配整块uint8标定张量，超过内存预算时改用磁盘映射
+    import numpy as np
+    shape = (count,) + tuple(input_shape)
+    nbytes = int(np.prod(shape))
+    budget = int(calib_conf.get('ram_budget_mb', 1024)) << 20
+    if nbytes <= budget:
+        return np.empty(shape, dtype=np.uint8), None
+
+    memmap_dir = calib_conf.get('memmap_dir', './calib_cache')
+    os.makedirs(memmap_dir, exist_ok=True)
+    fd, memmap_path = tempfile.mkstemp(prefix='calib_', suffix='.dat', dir=memmap_dir)
+    os.close(fd)
+    print(f"calib tensor {nbytes >> 20} MB > ram budget {budget >> 20} MB, use memmap {memmap_path}")
+    # 进程被强制结束时由父进程删除
+    stats.emit("temp", path=os.path.abspath(memmap_path))
+    return np.memmap(memmap_path, dtype=np.uint8, mode='w+', shape=shape), memmap_path
+
+
+def build_calib(files, conf, dataset, on_probed=None):
+    # on_probed: 解码耗时对比测完后调用，make 在此时才开始后台导入模型，避免争用 CPU 使对比失真
+    import calib_cache
+    calib_conf = conf.get('calib_options', {})
+    pre = preprocessor(conf)
+    # 每个样本包含 batch 张图片，最后一个样本不足时从头补齐
+    files = files + list(itertools.islice(itertools.cycle(files), -len(files) % pre.batch))
+
+    calib, memmap_path = alloc_calib(len(files) // pre.batch, pre.input_shape, calib_conf)
+    images = calib.reshape((-1,) + pre.image_shape)
+    todo = list(range(len(files)))
+    tensor_cache = calib_cache.open_cache(calib_conf, pre.signature(), dataset)
+    if tensor_cache is not None:
+        keys = [tensor_cache.file_key(f) for f in files]
+        todo = tensor_cache.load_into(images, keys)
+
+    if pre.reduced_decode and todo:
+        with stats.stage("decode_probe") as st:
+            st.update(pre.probe([files[i] for i in todo[:4]]))
+        print(f"reduced decode: {st['full_ms']} ms -> {st['reduced_ms']} ms per image, x{st['speedup']}")
+    if on_probed is not None:
+        on_probed()
+
+    workers = calib_workers(calib_conf)
+    pool = calib_conf.get('pool', 'thread')
+    total = len(files)
+    step = max(1, total // 100)
+    done = total - len(todo)
+    stats.progress("calib", done, total)
+    if pool == "process":
+        results = imap_index(pre.load, [files[i] for i in todo], workers, pool)
+    else:
+        # 线程内直接写入标定张量
+        load_into = functools.partial(pre.load_into, images)
+        results = imap_index(load_into, [(i, files[i]) for i in todo], workers, pool)
+    for j, img in results:
+        if pool == "process":
+            images[todo[j]] = img
+        done += 1
+        if done % step == 0 or done == total:
+            stats.progress("calib", done, total)
+
+    if tensor_cache is not None:
+        tensor_cache.update(images, keys, todo)
+    return calib, memmap_path
+
+
+def inspect_kmodel(kmodel_file, conf):
+    # 静态检查生成的 kmodel，结果记入运行报告；CPU 回退超过阈值时转换失败
+    inspect_conf = conf.get('inspect_options', {})
+    if not inspect_conf.get('enable', False):
+        return
+    import kmodel_inspect
+    with stats.stage("inspect") as st:
+        report = kmodel_inspect.inspect(kmodel_file)
+        st.update(report["summary"], partial=report["partial"])
+    kmodel_inspect.check(report, int(inspect_conf.get('max_cpu_fallback', -1)))
 
 
 def make(onnx_file, kmodel_file, dataset, toml_file):
-    calib = []
-    for t in gen(dataset):
-        calib.append(t)
+    import calib_select
+    conf = load_conf(toml_file)
+    calib_conf = conf.get('calib_options', {})
+    with stats.stage("select") as st:
+        files = list_files(dataset)
+        if not files:
+            raise FileNotFoundError(f"no calibration images in {dataset}")
+        with stats.stage("dedupe", images=len(files)) as dedupe_st:
+            files = calib_select.dedupe(files, calib_conf, calib_workers(calib_conf))
+            dedupe_st["dropped"] = dedupe_st["images"] - len(files)
+        files = calib_select.select_files(files, calib_conf, calib_workers(calib_conf))
+        st["images"] = len(files)
+
+    cache = kmodel_cache.open_cache(conf)
+    if cache is not None:
+        with stats.stage("kmodel_cache") as st:
+            key = kmodel_cache.make_key(onnx_file, conf, files, dataset, preprocessor(conf).signature())
+            st["hit"] = cache.fetch(key, kmodel_file)
+        if st["hit"]:
+            print(f"kmodel cache hit: {key[:12]}")
+            inspect_kmodel(kmodel_file, conf)
+            return
 
-    npcalib = np.array(calib).astype(np.uint8)
+    def import_model():
+        start = time.perf_counter()
+        c = Convertor(onnx_file, kmodel_file, toml_file, None)
+        return c, start, time.perf_counter()
 
-    #print("calib shape", npcalib.shape)
+    c = calib = memmap_path = None
+    try:
+        # 模型导入和编译器初始化放在后台线程，与标定图片的解码、预处理同时进行
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            importing = []
+            start = time.perf_counter()
+            with stats.stage("calib", images=len(files)) as calib_st:
+                calib, memmap_path = build_calib(files, conf, dataset,
+                                                 lambda: importing.append(executor.submit(import_model)))
+            calib_end = time.perf_counter()
+            c, import_start, import_end = importing[0].result()
+        calib_st["import_overlap_s"] = round(max(0.0, min(calib_end, import_end) - max(start, import_start)), 2)
+        print(f"import overlapped calibration by {calib_st['import_overlap_s']}s "
+              f"(import {import_end - import_start:.2f}s, calib {calib_end - start:.2f}s)")
+        if dedupe_st["dropped"]:
+            # 按本次每张图的标定耗时估算，不含 PTQ 本身随样本数减少的时间
+            dedupe_st["saved_s"] = round((calib_end - start) / len(files) * dedupe_st["dropped"], 2)
+            print(f"calib dedupe saved ~{dedupe_st['saved_s']}s of preprocessing")
+        #print("calib shape", calib.shape)
 
-    c = Convertor(onnx_file, kmodel_file, toml_file, [npcalib])
-    c.convert()
+        c.set_calib([calib])
+        c.convert()
+        if cache is not None:
+            cache.store(key, kmodel_file)
+        inspect_kmodel(kmodel_file, conf)
+    finally:
+        # 先释放映射再删除文件，windows下映射中的文件无法删除
+        c = None
+        calib = None
+        if memmap_path is not None:
+            os.remove(memmap_path)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import shutil
+import contextlib
+import hashlib
+import tempfile
+import zipsource
+
+chunk_size = 1 << 20
+
+
+def file_digest(path, h=None):
+    h = h or hashlib.sha256()
+    with zipsource.open_file(path) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h
+
+
+def nncase_version():
+    from importlib import metadata
+    versions = []
+    for dist in ("nncase", "nncase-kpu"):
+        try:
+            versions.append(f"{dist}={metadata.version(dist)}")
+        except metadata.PackageNotFoundError:
+            versions.append(f"{dist}=none")
+    return ";".join(versions)
+
+
+def calib_fingerprint(files, root):
+    # 按相对路径+内容哈希，重新解压后mtime变化也能命中
+    h = hashlib.sha256()
+    for f in files:
+        try:
+            name = os.path.relpath(f, root)
+        except ValueError:
+            # Windows 上数据集与 root 不在同一个盘符时没有相对路径
+            name = os.path.abspath(f)
+        h.update(name.replace(os.sep, "/").encode())
+        if zipsource.is_member(f):
+            # 压缩包内的文件用 CRC 代替内容哈希
+            h.update(zipsource.stat_key(f).encode())
+        else:
+            h.update(file_digest(f, hashlib.blake2b()).digest())
+    return h.hexdigest()
+
+
+def make_key(onnx_file, conf, files, root, extra=""):
+    h = file_digest(onnx_file)
+    opts = {k: conf.get(k, {}) for k in ("compile_options", "ptq_options", "onnx_options")}
+    h.update(json.dumps(opts, sort_keys=True).encode())
+    h.update(nncase_version().encode())
+    h.update(calib_fingerprint(files, root).encode())
+    h.update(extra.encode())
+    return h.hexdigest()
+
+
+class KmodelCache:
+    def __init__(self, cache_dir: str, max_size_mb: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_mb) << 20
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".kmodel")
+
+    def fetch(self, key, kmodel):
+        path = self._path(key)
+        try:
+            shutil.copyfile(path, kmodel)
+        except FileNotFoundError:
+            return False
+        # mtime作为最近使用时间
+        os.utime(path)
+        return True
+
+    def store(self, key, kmodel):
+        # 先写临时文件再原子替换，多个工程共享缓存目录时不会读到半个文件
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        os.close(fd)
+        try:
+            shutil.copyfile(kmodel, tmp)
+            os.replace(tmp, self._path(key))
+        except BaseException:
+            # 复制失败或被取消时不留下临时文件
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".kmodel"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def open_cache(conf):
+    cache_conf = conf.get('cache_options', {})
+    if not cache_conf.get('enable', False):
+        return None
+    cache_dir = cache_conf.get('dir') or os.path.join(
+        os.path.expanduser("~"), ".cache", "onnx2kmodel")
+    return KmodelCache(cache_dir, cache_conf.get('max_size_mb', 2048))
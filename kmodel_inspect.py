@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 不运行 kmodel，只解析文件头: 各模块(设备)的段大小、常量/权重大小、内存池估计、函数数量
+# 布局按 nncase 2.x (kmodel 版本 7) 生成的文件: model_header 后依次为各模块，
+# 每个模块为 module_header、各函数(function_header + 参数类型等)、各段(section_header + 内容)，
+# 所有 size 都包含各自的头。解析不一致时停止并标记 partial，仍输出已解析的部分
+
+import os
+import sys
+import json
+import struct
+import argparse
+
+kmodel_identifier = 0x4B4D444C  # 文件开头为 "LDMK"
+kmodel_version = 7
+model_header = struct.Struct("<8I")        # identifier, version, flags, alignment, modules, entry_module, entry_function, reserved
+module_header = struct.Struct("<16s4IQ")   # kind, version, sections, functions, reserved, size
+function_header = struct.Struct("<2I3Q")   # parameters, sections, entrypoint, text_size, size
+section_header = struct.Struct("<16s2I4Q") # name, flags, reserved, size, body_start, body_size, memory_size
+
+# 这些模块在 K230 的 CPU 上执行，其余(k230)在 KPU 上
+cpu_kinds = ("stackvm", "cpu")
+
+
+def cstr(raw):
+    return raw.split(b"\0", 1)[0].decode("ascii", "replace")
+
+
+def parse_module(data, offset, end):
+    kind, version, sections, functions, _, size = module_header.unpack_from(data, offset)
+    module = {"kind": cstr(kind), "version": version, "size": size, "functions": [], "sections": {}, "partial": False}
+    pos = offset + module_header.size
+    for _ in range(functions):
+        if pos + function_header.size > end:
+            module["partial"] = True
+            return module
+        parameters, _, _, text_size, fsize = function_header.unpack_from(data, pos)
+        if fsize < function_header.size or pos + fsize > end:
+            module["partial"] = True
+            return module
+        module["functions"].append({"parameters": parameters, "text_size": text_size})
+        pos += fsize
+    for _ in range(sections):
+        if pos + section_header.size > end:
+            module["partial"] = True
+            return module
+        name, _, _, ssize, _, body_size, memory_size = section_header.unpack_from(data, pos)
+        if ssize < section_header.size or pos + ssize > end:
+            module["partial"] = True
+            return module
+        module["sections"][cstr(name)] = {"body_size": body_size, "memory_size": memory_size}
+        pos += ssize
+    return module
+
+
+def inspect(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    report = {"file": os.path.basename(path), "file_size": len(data), "modules": [], "partial": False}
+    if len(data) < model_header.size:
+        raise ValueError(f"{path} is too small for a kmodel")
+    identifier, version, _, alignment, modules, entry_module, entry_function, _ = model_header.unpack_from(data, 0)
+    if identifier != kmodel_identifier:
+        raise ValueError(f"{path} is not a kmodel")
+    if version != kmodel_version:
+        # 其他版本的布局不同，不猜测
+        report.update(version=version, alignment=alignment, partial=True)
+        return summarize(report)
+    report.update(version=version, alignment=alignment, entry_module=entry_module, entry_function=entry_function)
+
+    offset = model_header.size
+    for _ in range(modules):
+        if offset + module_header.size > len(data):
+            report["partial"] = True
+            break
+        size = module_header.unpack_from(data, offset)[5]
+        end = min(offset + size, len(data)) if size else len(data)
+        module = parse_module(data, offset, end)
+        report["modules"].append(module)
+        report["partial"] |= module["partial"] or size == 0
+        if size == 0:
+            break
+        offset += size
+    return summarize(report)
+
+
+def summarize(report):
+    # 汇总成便于跨版本比较的数字
+    by_kind, sections = {}, {}
+    rdata = mapped = 0
+    fallback = 0
+    # 有 KPU 模块时入口函数只负责调度，不算作回退；整个模型都在 CPU 上时入口函数也算
+    has_kpu = any(m["kind"] not in cpu_kinds for m in report["modules"])
+    for i, module in enumerate(report["modules"]):
+        kind = module["kind"]
+        count = len(module["functions"])
+        by_kind[kind] = by_kind.get(kind, 0) + count
+        if kind in cpu_kinds:
+            fallback += count - (1 if has_kpu and i == report.get("entry_module") and count else 0)
+        for name, sec in module["sections"].items():
+            sections[f"{kind}{name}"] = sections.get(f"{kind}{name}", 0) + sec["body_size"]
+            mapped += sec["memory_size"]
+            if name == ".rdata":
+                rdata += sec["body_size"]
+    report["summary"] = {
+        "file_size": report["file_size"],
+        "rdata_bytes": rdata,
+        "sections": sections,
+        "functions_by_kind": by_kind,
+        "cpu_fallback_functions": fallback,
+        # 各段映射到内存的大小，作为运行时内存的粗略估计(不含输入输出和中间张量)
+        "est_memory_bytes": mapped,
+    }
+    return report
+
+
+def check(report, max_cpu_fallback):
+    # max_cpu_fallback < 0 表示不检查；只解析了一部分时无法确认，设置了阈值就不放行
+    fallback = report["summary"]["cpu_fallback_functions"]
+    if max_cpu_fallback >= 0 and report["partial"]:
+        raise RuntimeError(f"{report['file']}: kmodel v{report.get('version')} was only partly parsed, "
+                           f"cannot check max_cpu_fallback {max_cpu_fallback}")
+    if 0 <= max_cpu_fallback < fallback:
+        raise RuntimeError(f"{report['file']}: {fallback} CPU fallback functions > allowed {max_cpu_fallback}, "
+                           f"by kind: {report['summary']['functions_by_kind']}")
+
+
+def print_report(report, base=None):
+    s = report["summary"]
+    old = (base or {}).get("summary", {})
+
+    def row(name, value, prev):
+        delta = "" if prev is None else f"  ({value - prev:+,})"
+        print(f"  {name:<28} {value:>14,}{delta}")
+
+    print(f"{report['file']} (kmodel v{report.get('version')}){' [partial]' if report['partial'] else ''}")
+    for key in ("file_size", "rdata_bytes", "est_memory_bytes", "cpu_fallback_functions"):
+        row(key, s[key], old.get(key))
+    for name, size in sorted(s["sections"].items()):
+        row(f"section {name}", size, old.get("sections", {}).get(name))
+    for kind, count in sorted(s["functions_by_kind"].items()):
+        row(f"functions {kind}", count, old.get("functions_by_kind", {}).get(kind))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report sections, sizes, memory and per-device functions of a kmodel without running it")
+    parser.add_argument("kmodel")
+    parser.add_argument("--json", default=None, help="write the report as JSON")
+    parser.add_argument("--compare", default=None, help="JSON report of an earlier build to diff against")
+    parser.add_argument("--max-cpu-fallback", type=int, default=-1, help="fail if more CPU fallback functions than this")
+    args = parser.parse_args(argv)
+
+    report = inspect(args.kmodel)
+    base = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            base = json.load(f)
+    print_report(report, base)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+    try:
+        check(report, args.max_cpu_fallback)
+    except RuntimeError as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
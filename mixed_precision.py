@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 自动混合精度: 先用 dump_quant_error 得到逐层量化误差并导出 quant_scheme，
+# 按误差从大到小只把最差的 k 层提升为 int16，k 逐步增大直到模拟器上的精度达标
+
+import os
+import sys
+import csv
+import copy
+import glob
+import json
+import time
+import shutil
+import argparse
+import toml
+
+import convertor
+import sweep
+
+
+def find_file(_dir, pattern):
+    # nncase 把量化误差和 quant_scheme 写在 dump_dir 下，取最新的一个
+    found = glob.glob(os.path.join(_dir, "**", pattern), recursive=True)
+    if not found:
+        raise FileNotFoundError(f"{pattern} not found in {_dir}")
+    return max(found, key=os.path.getmtime)
+
+
+def read_quant_error(path):
+    # 表头为 name, cosine_error, mre_error；cosine_error 实际是与浮点结果的余弦相似度，越小误差越大
+    rows = []
+    column = None
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            cells = [c.strip() for c in row]
+            if column is None:
+                if "cosine_error" in cells:
+                    column = cells.index("cosine_error")
+                continue
+            try:
+                rows.append((cells[0], float(cells[column])))
+            except (ValueError, IndexError):
+                continue
+    if column is None:
+        raise ValueError(f"no cosine_error column in {path}")
+    return sorted(rows, key=lambda r: r[1])
+
+
+def promote(scheme, layers, dtype):
+    # 导出的 quant_scheme 中把指定层的输出改为 int16，返回新 scheme 和实际命中的层
+    scheme = copy.deepcopy(scheme)
+    names = set(layers)
+    hit = []
+    for output in scheme.get("Outputs", []):
+        if output.get("Name") in names:
+            output["DataType"] = dtype
+            hit.append(output["Name"])
+    return scheme, hit
+
+
+def compile_kmodel(name, onnx_file, conf, calib, out_dir):
+    conf_file = os.path.join(out_dir, name + ".toml")
+    kmodel = os.path.join(out_dir, name + ".kmodel")
+    with open(conf_file, 'w') as f:
+        toml.dump(conf, f)
+    start = time.perf_counter()
+    c = convertor.Convertor(onnx_file, kmodel, conf_file, [calib])
+    c.convert()
+    c = None
+    return kmodel, round(time.perf_counter() - start, 2)
+
+
+def evaluate(step, kmodel, holdout, refs):
+    outputs, sim_s = sweep.simulate(kmodel, holdout)
+    step["sim_ms"] = round(sim_s * 1000, 2)
+    step["kmodel_kb"] = round(os.path.getsize(kmodel) / 1024, 1)
+    step.update(sweep.output_error(outputs, refs))
+    print(f"  k={step['k']:<4} cosine {step['cosine']:.5f}  sim {step['sim_ms']} ms  compile {step['compile_s']}s")
+    return step
+
+
+def main(argv=None):
+    import numpy as np
+    parser = argparse.ArgumentParser(description="Promote the worst quantized layers to int16 until an accuracy target is met")
+    parser.add_argument("--onnx", required=True, help="best.onnx, may be inside a zip: model.zip/best.onnx")
+    parser.add_argument("--dataset", required=True, help="images/train, may be inside a zip")
+    parser.add_argument("--kmodel-conf", default="kmodel_conf.toml")
+    parser.add_argument("--out-dir", default="mixed_out")
+    parser.add_argument("--target", type=float, default=0.99, help="cosine similarity to the float model on held-out images")
+    parser.add_argument("--max-layers", type=int, default=64, help="give up after promoting this many layers")
+    parser.add_argument("--dtype", default="i16", help="DataType written to promoted layers in the quant scheme")
+    parser.add_argument("--holdout", type=int, default=8)
+    parser.add_argument("--output", default=None, help="copy the chosen kmodel here")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    base_conf = convertor.load_conf(args.kmodel_conf)
+    report = {"target_cosine": args.target, "costs": {}, "steps": []}
+
+    start = time.perf_counter()
+    calib_file, holdout_file, refs, report["calib_images"], report["holdout_images"] = sweep.prepare_data(
+        args.onnx, args.dataset, base_conf, args.out_dir, args.holdout)
+    if refs is None:
+        print("mixed precision search needs onnxruntime for the float reference: pip install onnxruntime")
+        return 1
+    calib = np.load(calib_file, mmap_mode='r')
+    holdout = np.load(holdout_file)
+    report["costs"]["prepare_s"] = round(time.perf_counter() - start, 2)
+
+    # 1. 全量化编译一次，同时导出逐层误差和 quant_scheme
+    dump_dir = os.path.abspath(os.path.join(args.out_dir, "dump"))
+    shutil.rmtree(dump_dir, ignore_errors=True)
+    conf = sweep.apply_overrides(base_conf, {
+        "compile_options.dump_ir": True, "compile_options.dump_dir": dump_dir,
+        "ptq_options.dump_quant_error": True, "ptq_options.export_quant_scheme": True,
+        "ptq_options.quant_scheme": "",
+    })
+    kmodel, compile_s = compile_kmodel("k0", args.onnx, conf, calib, args.out_dir)
+    report["costs"]["dump_s"] = compile_s
+    base = evaluate({"k": 0, "layers": [], "compile_s": compile_s}, kmodel, holdout, refs)
+    report["steps"].append(base)
+
+    # 2. 按误差排序
+    start = time.perf_counter()
+    ranking = read_quant_error(find_file(dump_dir, "*quant_error*.csv"))
+    with open(find_file(dump_dir, "*[Qq]uant*[Ss]cheme*.json"), 'r', encoding='utf-8') as f:
+        scheme = json.load(f)
+    report["costs"]["rank_s"] = round(time.perf_counter() - start, 3)
+    report["ranking"] = [{"layer": name, "cosine": value} for name, value in ranking]
+
+    # 3. k 按 1,2,4,... 增大直到达标，再在最后一段区间二分找最小的 k
+    def trial(k):
+        scheme_k, hit = promote(scheme, [name for name, _ in ranking[:k]], args.dtype)
+        scheme_file = os.path.abspath(os.path.join(args.out_dir, f"scheme_k{k}.json"))
+        with open(scheme_file, 'w', encoding='utf-8') as f:
+            json.dump(scheme_k, f, ensure_ascii=False, indent=4)
+        conf_k = sweep.apply_overrides(base_conf, {"ptq_options.quant_scheme": scheme_file,
+                                                   "ptq_options.quant_scheme_strict_mode": False})
+        kmodel_k, compile_s = compile_kmodel(f"k{k}", args.onnx, conf_k, calib, args.out_dir)
+        step = evaluate({"k": k, "layers": hit, "scheme": scheme_file, "compile_s": compile_s}, kmodel_k, holdout, refs)
+        report["steps"].append(step)
+        return step
+
+    best = base if base["cosine"] >= args.target else None
+    low, k = 0, 1
+    max_k = min(args.max_layers, len(ranking))
+    while best is None and low < max_k:
+        k = min(k, max_k)
+        step = trial(k)
+        if step["cosine"] >= args.target:
+            best = step
+            break
+        low, k = k, k * 2
+    while best is not None and best["k"] - low > 1:
+        step = trial((low + best["k"]) // 2)
+        if step["cosine"] >= args.target:
+            best = step
+        else:
+            low = step["k"]
+
+    report["costs"]["search_compile_s"] = round(sum(s["compile_s"] for s in report["steps"][1:]), 2)
+    report["chosen"] = best
+    report_path = os.path.join(args.out_dir, "mixed_precision.json")
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    if best is None:
+        print(f"target cosine {args.target} not reached with {max_k} int16 layers")
+        print(f"报告: {report_path}")
+        return 1
+    print(f"chosen k={best['k']}: cosine {best['cosine']:.5f}, sim {best['sim_ms']} ms "
+          f"(all-{base_conf['ptq_options']['quant_type']} {base['sim_ms']} ms)")
+    for layer in best["layers"]:
+        print(f"  int16: {layer}")
+    if args.output:
+        shutil.copy(os.path.join(args.out_dir, f"k{best['k']}.kmodel"), args.output)
+    print(f"报告: {report_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+# import_onnx 之前的可选图优化: 固定输入尺寸、形状推导、常量折叠、
+# 去掉 Identity/无用节点、合并相邻的 Transpose/Reshape，可选截掉检测后处理
+
+import onnx
+import numpy as np
+from onnx import helper, numpy_helper, shape_inference
+
+# 结果不确定或带子图的算子不折叠
+no_fold = {"RandomNormal", "RandomNormalLike", "RandomUniform", "RandomUniformLike", "Multinomial",
+           "If", "Loop", "Scan"}
+max_fold_bytes = 64 << 20
+
+
+def graph_inputs(graph):
+    inits = set(i.name for i in graph.initializer)
+    return [i for i in graph.input if i.name not in inits]
+
+
+def fix_input_shape(model, compile_options):
+    # compile_options.input_shape 是 kmodel 的输入布局，onnx 模型本身为 NCHW
+    shape = list(compile_options['input_shape'])
+    if compile_options.get('input_layout', "NCHW") == "NHWC":
+        shape = [shape[0], shape[3], shape[1], shape[2]]
+    dims = graph_inputs(model.graph)[0].type.tensor_type.shape.dim
+    for dim, value in zip(dims, shape):
+        dim.ClearField("dim_param")
+        dim.dim_value = int(value)
+    # 旧的中间形状可能是动态的，清空后重新推导
+    del model.graph.value_info[:]
+
+
+def static_shapes(model):
+    shapes = {}
+    for vi in list(model.graph.value_info) + list(model.graph.input) + list(model.graph.output):
+        dims = vi.type.tensor_type.shape.dim
+        if vi.type.tensor_type.HasField("shape") and all(d.HasField("dim_value") for d in dims):
+            shapes[vi.name] = [d.dim_value for d in dims]
+    return shapes
+
+
+def replace_input(graph, old, new):
+    for node in graph.node:
+        for i, name in enumerate(node.input):
+            if name == old:
+                node.input[i] = new
+
+
+def consumers(graph):
+    users = {}
+    for node in graph.node:
+        for name in node.input:
+            users.setdefault(name, []).append(node)
+    return users
+
+
+def fold_constants(model):
+    # 输入全部为常量的节点直接求值，结果变成 initializer
+    from onnx.reference import ReferenceEvaluator
+
+    graph = model.graph
+    opsets = {o.domain: o.version for o in model.opset_import}
+    shapes = static_shapes(model)
+    consts = {i.name: numpy_helper.to_array(i) for i in graph.initializer}
+    outputs = set(o.name for o in graph.output)
+    folded = []
+    for node in graph.node:
+        if node.op_type in no_fold or node.domain not in ("", "ai.onnx"):
+            continue
+        if node.op_type == "Shape" and node.input[0] in shapes:
+            # 输入形状已固定时 Shape 可以直接算出
+            dims = np.array(shapes[node.input[0]], dtype=np.int64)
+            attrs = {a.name: helper.get_attribute_value(a) for a in node.attribute}
+            values = [dims[attrs.get("start", 0):attrs.get("end", len(dims))]]
+        elif all(name == "" or name in consts for name in node.input):
+            try:
+                feeds = {name: consts[name] for name in node.input if name}
+                values = ReferenceEvaluator(node, opsets=opsets).run(None, feeds)
+            except Exception:
+                continue
+        else:
+            continue
+        if any(np.asarray(v).nbytes > max_fold_bytes for v in values):
+            continue
+        if any(name in outputs for name in node.output):
+            continue
+        for name, value in zip(node.output, values):
+            consts[name] = np.asarray(value)
+            graph.initializer.append(numpy_helper.from_array(np.asarray(value), name))
+        folded.append(node)
+
+    for node in folded:
+        graph.node.remove(node)
+    return len(folded)
+
+
+def remove_identity(graph):
+    outputs = set(o.name for o in graph.output)
+    removed = 0
+    for node in list(graph.node):
+        if node.op_type == "Identity" and node.output[0] not in outputs:
+            replace_input(graph, node.output[0], node.input[0])
+            graph.node.remove(node)
+            removed += 1
+    return removed
+
+
+def fuse_transpose(model):
+    # Transpose->Transpose 合并为一个，合并后是恒等变换则两个都去掉
+    graph = model.graph
+    outputs = set(o.name for o in graph.output)
+    users = consumers(graph)
+    producer = {o: n for n in graph.node for o in n.output}
+    changed = 0
+    for node in list(graph.node):
+        if node.op_type != "Transpose":
+            continue
+        perm = list(helper.get_attribute_value(node.attribute[0])) if node.attribute else None
+        if perm == list(range(len(perm or [0]))) and node.output[0] not in outputs:
+            replace_input(graph, node.output[0], node.input[0])
+            changed += 1
+            continue
+        first = producer.get(node.input[0])
+        if (first is None or first.op_type != "Transpose" or not first.attribute or perm is None
+                or len(users.get(first.output[0], [])) != 1 or first.output[0] in outputs):
+            continue
+        first_perm = list(helper.get_attribute_value(first.attribute[0]))
+        composed = [first_perm[i] for i in perm]
+        node.input[0] = first.input[0]
+        del node.attribute[:]
+        node.attribute.append(helper.make_attribute("perm", composed))
+        changed += 1
+    return changed
+
+
+def fuse_reshape(model):
+    # Reshape->Reshape 只保留后一个；输入输出形状相同的 Reshape 去掉
+    graph = model.graph
+    outputs = set(o.name for o in graph.output)
+    users = consumers(graph)
+    producer = {o: n for n in graph.node for o in n.output}
+    consts = {i.name: numpy_helper.to_array(i) for i in graph.initializer}
+    shapes = static_shapes(model)
+    changed = 0
+    for node in list(graph.node):
+        if node.op_type != "Reshape" or node.input[1] not in consts:
+            continue
+        target = consts[node.input[1]]
+        if 0 in target:
+            continue
+        src = node.input[0]
+        if (src in shapes and list(target) == shapes[src] and node.output[0] not in outputs):
+            replace_input(graph, node.output[0], src)
+            changed += 1
+            continue
+        first = producer.get(src)
+        if (first is not None and first.op_type == "Reshape"
+                and len(users.get(first.output[0], [])) == 1 and first.output[0] not in outputs):
+            node.input[0] = first.input[0]
+            changed += 1
+    return changed
+
+
+def strip_outputs(model, names):
+    # 用指定的中间张量作为新的模型输出，之后的后处理节点会被当作无用节点删掉
+    inferred = {vi.name: vi for vi in shape_inference.infer_shapes(model).graph.value_info}
+    missing = [name for name in names if name not in inferred]
+    if missing:
+        raise ValueError(f"strip_outputs: unknown tensors {missing}")
+    del model.graph.output[:]
+    model.graph.output.extend(inferred[name] for name in names)
+
+
+def remove_dead(graph):
+    needed = set(o.name for o in graph.output)
+    keep = []
+    for node in reversed(graph.node):
+        if any(o in needed for o in node.output):
+            keep.append(node)
+            needed.update(i for i in node.input if i)
+    removed = len(graph.node) - len(keep)
+    keep.reverse()
+    del graph.node[:]
+    graph.node.extend(keep)
+
+    unused = set(i.name for i in graph.initializer if i.name not in needed)
+    inits = [i for i in graph.initializer if i.name not in unused]
+    del graph.initializer[:]
+    graph.initializer.extend(inits)
+    # 旧版 ir 中 initializer 也列在 graph.input 里，一并去掉
+    inputs = [i for i in graph.input if i.name not in unused]
+    del graph.input[:]
+    graph.input.extend(inputs)
+    return removed
+
+
+def optimize(model_bytes, conf):
+    opts = conf.get('onnx_options', {})
+    model = onnx.load_from_string(model_bytes)
+    before = len(model.graph.node)
+
+    if opts.get('fix_input_shape', True):
+        fix_input_shape(model, conf['compile_options'])
+    if opts.get('strip_outputs'):
+        strip_outputs(model, opts['strip_outputs'])
+    remove_identity(model.graph)
+    for _ in range(4):
+        model = shape_inference.infer_shapes(model)
+        changed = 0
+        if opts.get('fold_constants', True):
+            changed += fold_constants(model)
+        changed += fuse_transpose(model) + fuse_reshape(model)
+        changed += remove_dead(model.graph)
+        if not changed:
+            break
+
+    onnx.checker.check_model(model)
+
+    after = len(model.graph.node)
+    print(f"onnx optimize: {before} -> {after} nodes ({before - after} removed)")
+    return model.SerializeToString(), before, after
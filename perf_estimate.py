@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# 估计每帧推理耗时，据此设置 conf.json 的 fps_limit 和 infer_isp 尺寸
+# macs: 按 onnx 中 Conv/Gemm/MatMul 的乘加次数和 KPU 有效算力估算，需要 pip install onnx
+# simulator: nncase 模拟器上实测，再乘以 sim_scale 换算到设备
+
+import time
+import zipsource
+
+
+def count_macs(onnx_file, compile_options):
+    import onnx
+    import onnx_opt
+    from onnx import shape_inference
+
+    model = onnx.load_from_string(zipsource.read_bytes(onnx_file))
+    onnx_opt.fix_input_shape(model, compile_options)
+    model = shape_inference.infer_shapes(model)
+    shapes = onnx_opt.static_shapes(model)
+    shapes.update({i.name: list(i.dims) for i in model.graph.initializer})
+
+    def prod(dims):
+        n = 1
+        for d in dims:
+            n *= d
+        return n
+
+    macs = 0
+    for node in model.graph.node:
+        out = shapes.get(node.output[0])
+        if out is None:
+            continue
+        if node.op_type == "Conv" and node.input[1] in shapes:
+            # 权重 [Cout, Cin/group, kh, kw]，每个输出元素 Cin/group*kh*kw 次乘加
+            macs += prod(out) * prod(shapes[node.input[1]][1:])
+        elif node.op_type == "ConvTranspose" and node.input[0] in shapes and node.input[1] in shapes:
+            macs += prod(shapes[node.input[0]]) * prod(shapes[node.input[1]][1:])
+        elif node.op_type in ("Gemm", "MatMul") and node.input[0] in shapes:
+            a = shapes[node.input[0]]
+            trans_a = any(attr.name == "transA" and attr.i for attr in node.attribute)
+            macs += prod(out) * (a[0] if trans_a else a[-1])
+    return macs
+
+
+def simulate_ms(kmodel, input_shape, runs=3):
+    import numpy as np
+    import convertor
+    nncase = convertor.load_nncase()
+    sim = nncase.Simulator()
+    with open(kmodel, 'rb') as f:
+        sim.load_model(f.read())
+    sim.set_input_tensor(0, nncase.RuntimeTensor.from_numpy(np.zeros(input_shape, dtype=np.uint8)))
+    sim.run()
+    start = time.perf_counter()
+    for _ in range(runs):
+        sim.run()
+    return (time.perf_counter() - start) / runs * 1000
+
+
+def isp_size(runtime_conf, width, height):
+    # 取不小于模型输入的最小 ISP 尺寸，ISP 输出越小设备上的缩放越省时
+    sizes = sorted(runtime_conf.get('isp_sizes', [[640, 360], [864, 486], [1280, 720]]), key=lambda s: s[0] * s[1])
+    for w, h in sizes:
+        if max(width / w, height / h) <= 1:
+            return [w, h]
+    return sizes[-1]
+
+
+def estimate(conf, onnx_file, kmodel):
+    import convertor
+    runtime_conf = conf.get('runtime_options', {})
+    compile_options = conf['compile_options']
+    pre = convertor.preprocessor(conf)
+    result = {"method": runtime_conf.get('method', "macs")}
+
+    if result["method"] == "simulator":
+        result["sim_ms"] = round(simulate_ms(kmodel, pre.input_shape), 2)
+        result["infer_ms"] = round(result["sim_ms"] * float(runtime_conf.get('sim_scale', 1.0)), 2)
+    elif result["method"] == "macs":
+        macs = count_macs(onnx_file, compile_options)
+        result["gmacs"] = round(macs / 1e9, 3)
+        result["infer_ms"] = round(macs / (float(runtime_conf.get('kpu_gmacs', 100)) * 1e9) * 1000, 2)
+    else:
+        raise ValueError(f"unknown runtime_options.method: {result['method']}")
+
+    # 每帧总耗时 = 推理 + ISP/前后处理/显示的固定开销
+    frame_ms = result["infer_ms"] + float(runtime_conf.get('overhead_ms', 20))
+    fps = int(1000 / frame_ms)
+    result["fps_limit"] = max(int(runtime_conf.get('min_fps', 5)), min(int(runtime_conf.get('max_fps', 30)), fps))
+    result["infer_isp"] = isp_size(runtime_conf, pre.width, pre.height)
+    print(f"estimated {result['infer_ms']} ms/frame ({result['method']}), fps_limit {result['fps_limit']}, "
+          f"isp {result['infer_isp'][0]}x{result['infer_isp'][1]}")
+    return result
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+
+import os
+import copy
+import json
+import shutil
+import zipfile
+import hashlib
+import zlib
+import re
+import time
+import traceback
+import stats
+import stages
+import zipsource
+from concurrent.futures import ThreadPoolExecutor
+
+conf_template = {
+    "conf": {
+        "application": "",
+        "defconfig": {"det_thres": 0.3, "nms_thres": 0.6},
+        "infer_isp": {"format": "BG3P", "channel": 3, "width": 864, "height": 486},
+        "fps_limit": 15,
+        "model_info": [{"name": "object-detection-detector", "filename": ""}],
+        "model_attach": {"classes": {"en": [], "zh-CN": [], "zh-TW": []}}
+    }
+}
+
+desc_template = {
+    "desc": {
+        "application_name": ["name", "名字", "名字"],
+        "application_title": ["title", "抬头", "抬頭"],
+        "stream": True,
+        "version": "0.1"
+    }
+}
+
+def clean_name(name):
+    name = name.replace("\\n", "\n")
+    name = name.lower()
+    name = re.sub(r'[^a-z0-9]', '_', name)
+    name = re.sub(r'_+', '_', name)
+    return name.strip('_')
+
+# 转换只需要这些成员，验证集等其它文件不解压
+needed_members = ("best.onnx", "data.yaml", "images/train/", "labels/train/")
+
+
+def is_needed(name):
+    return name in needed_members or name.startswith(needed_members[2:])
+
+
+def extract_member(zip_ref, member, target_path):
+    # 分块流式写出，并保留压缩包内的修改时间，方便标定缓存按mtime命中
+    os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+    with zip_ref.open(member) as source, open(target_path, "wb") as target:
+        shutil.copyfileobj(source, target, 1 << 20)
+    mtime = time.mktime(member.date_time + (0, 0, -1))
+    os.utime(target_path, (mtime, mtime))
+
+
+def extract_members(zip_path, output_dir, target_of, workers=None):
+    # target_of(name) 返回相对输出路径的各级目录，返回 None 表示跳过
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        jobs = []
+        for member in zip_ref.infolist():
+            parts = target_of(member.filename)
+            if not parts or member.is_dir() or ".." in parts or os.path.isabs(parts[0]):
+                continue
+            jobs.append((member, os.path.join(output_dir, *parts)))
+        # 多个成员并行解压，zipfile 内部对共享文件句柄加锁，解压缩在各线程中进行
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            done = 0
+            for _ in executor.map(lambda job: extract_member(zip_ref, *job), jobs):
+                done += 1
+                if done % 64 == 0 or done == len(jobs):
+                    stats.progress("extract", done, len(jobs), archive=os.path.basename(zip_path))
+    return len(jobs)
+
+
+def extract_zip(zip_path, output_dir="model_input", only_needed=True):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    def target_of(name):
+        if only_needed and not is_needed(name):
+            return None
+        return name.split('/')
+
+    extract_members(zip_path, output_dir, target_of)
+    return output_dir
+
+
+def extract_zip_without_top(zip_path, output_dir="model_input", only_needed=True):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    def target_of(name):
+        # 去掉顶层目录
+        parts = name.split('/')
+        if len(parts) > 1:
+            parts = parts[1:]
+        if only_needed and not is_needed('/'.join(parts)):
+            return None
+        return parts
+
+    extract_members(zip_path, output_dir, target_of)
+    print("解压完成！")
+
+
+def compress_type(path, package_conf):
+    # 已压缩或高熵的文件直接存储，其余文件先试压开头一段再决定
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix in package_conf.get('store_suffixes', [".kmodel", ".png", ".jpg", ".jpeg", ".zip"]):
+        return zipfile.ZIP_STORED
+    with open(path, "rb") as f:
+        head = f.read(1 << 16)
+    if head and len(zlib.compress(head, 1)) > 0.9 * len(head):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def package_options(kmodel_conf="kmodel_conf.toml"):
+    import convertor
+    if not os.path.exists(kmodel_conf):
+        return {}
+    return convertor.load_conf(kmodel_conf).get('package_options', {})
+
+
+def zip_with_md5(source_dir="model_output/", zip_dir="./", base_name="app", package_conf=None):
+    package_conf = package_conf or {}
+    level = package_conf.get('compress_level', 6)
+    with stats.stage("package") as st:
+        temp_zip_path = os.path.join(zip_dir, f"{base_name}.zip")
+        # 写入可 seek 的文件，zipfile 会回填本地文件头的 CRC 和大小，不使用数据描述符；
+        # 设备上的流式解压(busybox unzip 等)不接受 STORED + 数据描述符的条目
+        md5 = hashlib.md5()
+        with open(temp_zip_path, "w+b") as f:
+            with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                for root, dirs, files in os.walk(source_dir):
+                    dirs.sort()
+                    for file in sorted(files):
+                        abs_path = os.path.join(root, file)
+                        rel_path = os.path.relpath(abs_path, source_dir)
+                        zipf.write(abs_path, arcname=rel_path,
+                                   compress_type=compress_type(abs_path, package_conf), compresslevel=level)
+                        stats.progress("package", f.tell(), unit="bytes", file=rel_path)
+            st["bytes"] = f.tell()
+            # 刚写完的数据还在页缓存中，回读计算 md5
+            f.seek(0)
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                md5.update(chunk)
+        md5_str = md5.hexdigest()[:4]
+        final_zip_path = os.path.join(zip_dir, f"{base_name}.{md5_str}.zip")
+        # 同目录下替换文件名，不会复制数据
+        os.replace(temp_zip_path, final_zip_path)
+    print(f"打包完成: {final_zip_path}")
+    return final_zip_path
+
+
+def app_id(conf):
+    return "dfrobot_" + clean_name(conf["comm"]["app_name_EN"])
+
+
+def input_paths(base_dir):
+    return {
+        "onnx": os.path.join(base_dir, "best.onnx"),
+        "data_yaml": os.path.join(base_dir, "data.yaml"),
+        "images": os.path.join(base_dir, "images", "train"),
+    }
+
+
+def prepare_input(conf, input_dir="model_input", graph=None):
+    # 返回 best.onnx, data.yaml, images/train 的路径；graph 不为空时压缩包没变就不重新解压
+    if conf["comm"]["mode"] != "MindPlus":
+        return input_paths(conf["user_options"]["user_dir"])
+
+    #制作MindPlus数据目录
+    model_zip = conf["mindplus_options"]["model_zip"]
+    if not model_zip or not os.path.exists(model_zip):
+        raise FileNotFoundError(f"模型包不存在: {model_zip}")
+    dataset_zip = conf["mindplus_options"]["dataset_zip"]
+    if not dataset_zip or not os.path.exists(dataset_zip):
+        raise FileNotFoundError(f"数据集包不存在: {dataset_zip}")
+    # 压缩包可能已被重新导出，丢弃之前打开的句柄
+    zipsource.close_all()
+
+    if not conf["mindplus_options"].get("extract", False):
+        # 不解压，直接从压缩包读取
+        paths = {
+            "onnx": zipsource.join(model_zip, "best.onnx"),
+            "data_yaml": zipsource.join(dataset_zip, "data.yaml"),
+            "images": zipsource.join(dataset_zip, "images/train"),
+        }
+        for path in (paths["onnx"], paths["data_yaml"]):
+            if not zipsource.exists(path):
+                raise FileNotFoundError(f"压缩包内缺少文件: {path}")
+        return paths
+
+    def extract():
+        with stats.stage("extract"):
+            if os.path.exists(input_dir):
+                shutil.rmtree(input_dir)
+            os.makedirs(input_dir, exist_ok=True)
+            extract_zip(model_zip, input_dir)
+            #extract_zip_without_top(dataset_zip, input_dir)
+            extract_zip(dataset_zip, input_dir)
+        return input_paths(input_dir)
+
+    if graph is None:
+        return extract()
+    inputs = {"zips": [stages.path_key(model_zip), stages.path_key(dataset_zip)], "input_dir": os.path.abspath(input_dir)}
+    return graph.run("extract", inputs, extract, lambda result: [input_dir])
+
+
+def read_names(yaml_path):
+    import yaml
+    #读取数据集标签
+    source_config = yaml.safe_load(zipsource.read_bytes(yaml_path).decode("utf-8"))
+    names = source_config.get("names", {})
+    return [names[i] for i in sorted(names.keys())]
+
+
+def write_metadata(conf, name_list, output_dir="model_output", runtime=None):
+    with stats.stage("metadata"):
+        return _write_metadata(conf, name_list, output_dir, runtime)
+
+
+def _write_metadata(conf, name_list, output_dir, runtime=None):
+    comm = conf["comm"]
+    conf_data = copy.deepcopy(conf_template)
+    conf_data["conf"]["application"] = app_id(conf)
+    conf_data["conf"]["model_attach"]["classes"]["zh-CN"] = name_list
+    conf_data["conf"]["model_attach"]["classes"]["zh-TW"] = name_list
+    conf_data["conf"]["model_attach"]["classes"]["en"] = name_list
+    conf_data["conf"]["model_info"][0]["filename"] = conf_data["conf"]["application"] + ".kmodel"
+    conf_data["conf"]["defconfig"]["det_thres"] = comm["det_threshold"]
+    if runtime:
+        # 按估计的每帧耗时设置帧率上限和 ISP 输出尺寸，估计结果一起打包便于比较
+        conf_data["conf"]["fps_limit"] = runtime["fps_limit"]
+        conf_data["conf"]["infer_isp"]["width"], conf_data["conf"]["infer_isp"]["height"] = runtime["infer_isp"]
+
+    os.makedirs(output_dir, exist_ok=True)
+    if runtime:
+        with open(os.path.join(output_dir, "perf.json"), "w", encoding="utf-8") as f:
+            json.dump(runtime, f, ensure_ascii=False, indent=4)
+    with open(os.path.join(output_dir, "conf.json"), "w", encoding="utf-8") as f:
+        json.dump(conf_data, f, ensure_ascii=False, indent=4)
+
+    desc_data = copy.deepcopy(desc_template)
+    desc_data["desc"]["application_name"] = [
+        comm["app_name_EN"].replace("\\n", "\n"), comm["app_name_zh_CN"].replace("\\n", "\n"), comm["app_name_zh_TW"].replace("\\n", "\n")
+    ]
+    desc_data["desc"]["application_title"] = [
+        comm["title_name_EN"].replace("\\n", "\n"), comm["title_name_zh_CN"].replace("\\n", "\n"), comm["title_name_zh_TW"].replace("\\n", "\n")
+    ]
+    with open(os.path.join(output_dir, "desc.json"), "w", encoding="utf-8") as f:
+        json.dump(desc_data, f, ensure_ascii=False, indent=4)
+
+    icon_file = comm["icon_file"]
+    if os.path.exists(icon_file):
+        shutil.copy(icon_file, os.path.join(output_dir, os.path.basename(icon_file)))
+    # 创建空文件
+    open(os.path.join(output_dir, f"app.{conf_data['conf']['application']}"), "w").close()
+    return conf_data
+
+
+def metadata_files(conf_data, conf, output_dir, runtime=None):
+    files = ["conf.json", "desc.json", f"app.{conf_data['conf']['application']}"]
+    if runtime:
+        files.append("perf.json")
+    if os.path.exists(conf["comm"]["icon_file"]):
+        files.append(os.path.basename(conf["comm"]["icon_file"]))
+    return [os.path.join(output_dir, f) for f in files]
+
+
+def estimate_runtime(kconf, onnx_file, kmodel_path):
+    # 估计失败(例如没有安装 onnx)时保留模板中的 fps_limit 和 infer_isp
+    if not kconf.get('runtime_options', {}).get('enable', False):
+        return None
+    import perf_estimate
+    with stats.stage("runtime") as st:
+        try:
+            runtime = perf_estimate.estimate(kconf, onnx_file, kmodel_path)
+        except Exception as e:
+            print(f"runtime estimate failed, keeping fps_limit {conf_template['conf']['fps_limit']}: {e}")
+            return None
+        st.update(runtime)
+    return runtime
+
+
+def state_path(output_dir):
+    # 放在 model_output 旁边，不会被打进安装包
+    return os.path.join(os.path.dirname(os.path.abspath(output_dir)), ".stages.json")
+
+
+def start_report(kmodel_conf="kmodel_conf.toml", profile=None):
+    # profile: None 使用 kmodel_conf.toml 中的设置, "cprofile", "tracemalloc"
+    import convertor
+    report_conf = convertor.load_conf(kmodel_conf).get('report_options', {})
+    if profile is None:
+        if not report_conf.get('enable', False):
+            return
+        profile = report_conf.get('profile', "")
+    stats.begin(profile)
+
+
+def finish_report(package):
+    # 报告与安装包放在同一目录
+    return stats.save(os.path.splitext(package)[0] + ".report.json")
+
+
+def export(conf, kmodel_conf="kmodel_conf.toml", input_dir="model_input",
+           output_dir="model_output", zip_dir="./", profile=None):
+    # 与GUI的 转换&打包 相同的完整流程，返回安装包路径
+    # 各阶段按输入指纹增量执行，例如只改了标题或阈值时只重写 metadata 并重新打包
+    import convertor
+    import kmodel_cache
+    start_report(kmodel_conf, profile)
+    # convert 在 metadata 之前执行，kmodel 直接写入 output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    graph = stages.StageGraph(state_path(output_dir))
+    _kconf = convertor.load_conf(kmodel_conf)
+
+    paths = prepare_input(conf, input_dir, graph)
+    names = graph.run("labels", {"data_yaml": paths["data_yaml"], "key": stages.path_key(paths["data_yaml"])},
+                      lambda: read_names(paths["data_yaml"]))
+
+    # 标定和编译都在 convertor.make 中完成，作为一个阶段
+    kmodel_path = os.path.join(output_dir, app_id(conf) + ".kmodel")
+    convert_inputs = {
+        "onnx": paths["onnx"], "onnx_key": stages.path_key(paths["onnx"]),
+        "images": stages.files_key(convertor.list_files(paths["images"])),
+        "kmodel": os.path.abspath(kmodel_path),
+        "conf": {k: _kconf.get(k, {}) for k in ("compile_options", "ptq_options", "onnx_options", "calib_options",
+                                                     "inspect_options")},
+        "nncase": kmodel_cache.nncase_version(),
+    }
+
+    def convert():
+        convertor.make(paths["onnx"], kmodel_path, paths["images"], kmodel_conf)
+        return kmodel_path
+
+    graph.run("convert", convert_inputs, convert, lambda result: [result])
+
+    # conf.json 中的帧率和 ISP 尺寸依赖 kmodel 的耗时估计，所以 metadata 放在转换之后
+    runtime_inputs = {"onnx_key": convert_inputs["onnx_key"], "kmodel": stages.path_key(kmodel_path),
+                      "conf": {k: _kconf.get(k, {}) for k in ("compile_options", "runtime_options")}}
+    runtime = graph.run("runtime", runtime_inputs, lambda: estimate_runtime(_kconf, paths["onnx"], kmodel_path))
+
+    meta_inputs = {"comm": conf["comm"], "names": names, "icon": stages.path_key(conf["comm"]["icon_file"]),
+                   "runtime": runtime, "output_dir": os.path.abspath(output_dir)}
+    conf_data = graph.run("metadata", meta_inputs, lambda: write_metadata(conf, names, output_dir, runtime),
+                          lambda result: metadata_files(result, conf, output_dir, runtime))
+    package = pack(conf_data["conf"]["application"], kmodel_conf, output_dir, zip_dir, graph)
+    finish_report(package)
+    return package
+
+
+def pack(base_name, kmodel_conf="kmodel_conf.toml", output_dir="model_output", zip_dir="./", graph=None):
+    # model_output 和打包选项都没变时直接返回上次的安装包
+    graph = graph or stages.StageGraph(state_path(output_dir))
+    package_conf = package_options(kmodel_conf)
+    inputs = {"output_dir": stages.path_key(output_dir), "zip_dir": os.path.abspath(zip_dir),
+              "base_name": base_name, "package_options": package_conf}
+    return graph.run("package", inputs, lambda: zip_with_md5(output_dir, zip_dir, base_name, package_conf),
+                     lambda result: [result])
+
+
+def export_process(events, conf, kmodel_conf="kmodel_conf.toml", input_dir="model_input",
+                   output_dir="model_output", zip_dir="./"):
+    # 界面子进程入口，阶段和进度以字典形式放入 events 队列，最后发送 done 或 error
+    stats.set_listener(events.put)
+    try:
+        package = export(conf, kmodel_conf, input_dir, output_dir, zip_dir)
+    except Exception as e:
+        traceback.print_exc()
+        events.put({"event": "error", "error": f"{type(e).__name__}: {e}"})
+    else:
+        events.put({"event": "done", "package": package})
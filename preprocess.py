@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import time
+import threading
+import cv2
+import numpy as np
+import zipsource
+
+# 每个线程复用一块 HxWx3 画布，NCHW 转置前使用
+_scratch = threading.local()
+
+
+def imread(path, flags=cv2.IMREAD_COLOR):
+    # 压缩包内的图片直接在内存中解码
+    if not zipsource.is_member(path):
+        return cv2.imread(path, flags)
+    data = np.frombuffer(zipsource.read_bytes(path), dtype=np.uint8)
+    return cv2.imdecode(data, flags)
+
+
+# jpeg 可以在 DCT 域直接按 1/2、1/4、1/8 解码
+reduced_flags = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+sof_markers = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def jpeg_size(data):
+    # 从 SOF 段读出宽高，不是 jpeg 或找不到时返回 None
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+        if marker in sof_markers:
+            return int.from_bytes(data[i + 7:i + 9], "big"), int.from_bytes(data[i + 5:i + 7], "big")
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+class Preprocessor:
+    # 按 kmodel_conf.toml 的 compile_options 生成标定数据:
+    # 等比缩放后直接写入画布(letterbox)，NHWC 直接写入标定张量，NCHW 只做一次转置拷贝
+    def __init__(self, compile_options: dict, reduced_decode=False):
+        self.layout = compile_options.get('input_layout', "NCHW")
+        shape = [int(v) for v in compile_options.get('input_shape', [1, 3, 320, 320])]
+        if self.layout == "NHWC":
+            self.batch, self.height, self.width, channels = shape
+        else:
+            self.batch, channels, self.height, self.width = shape
+        assert channels == 3, print(f'not support input shape {shape}')
+        self.input_shape = tuple(shape)
+        # swapRB 时 kmodel 内部交换通道，输入保持 opencv 的 BGR
+        self.rgb = not compile_options.get('swapRB', False)
+        self.pad_value = int(compile_options.get('letterbox_value', 0))
+        self.reduced_decode = reduced_decode
+
+    @property
+    def image_shape(self):
+        return self.input_shape[1:]
+
+    def signature(self):
+        # 预处理参数签名，改变预处理方式后缓存自动失效
+        order = "rgb" if self.rgb else "bgr"
+        reduced = ",reduced" if self.reduced_decode else ""
+        return f"{order},letterbox{self.pad_value},{self.width}x{self.height},{self.layout}{reduced}"
+
+    def _canvas(self):
+        canvas = getattr(_scratch, "canvas", None)
+        if canvas is None or canvas.shape != (self.height, self.width, 3):
+            canvas = np.empty((self.height, self.width, 3), dtype=np.uint8)
+            _scratch.canvas = canvas
+        return canvas
+
+    def __call__(self, img, out=None):
+        if out is None:
+            out = np.empty(self.image_shape, dtype=np.uint8)
+        canvas = out if self.layout == "NHWC" else self._canvas()
+
+        h, w = img.shape[:2]
+        scale = min(self.width / w, self.height / h)
+        nw, nh = max(1, round(w * scale)), max(1, round(h * scale))
+        left, top = (self.width - nw) // 2, (self.height - nh) // 2
+
+        # 只填充边框，中间区域由 resize 直接写入
+        canvas[:top] = self.pad_value
+        canvas[top + nh:] = self.pad_value
+        canvas[top:top + nh, :left] = self.pad_value
+        canvas[top:top + nh, left + nw:] = self.pad_value
+        cv2.resize(img, (nw, nh), dst=canvas[top:top + nh, left:left + nw])
+
+        if self.layout == "NHWC":
+            if self.rgb:
+                cv2.cvtColor(out, cv2.COLOR_BGR2RGB, dst=out)
+        else:
+            src = canvas[:, :, ::-1] if self.rgb else canvas
+            out[...] = src.transpose(2, 0, 1)
+        return out
+
+    def decode_flags(self, size):
+        # 取缩小后仍不小于 letterbox 尺寸的最大倍数，exif 旋转后宽高可能互换，两种方向都要满足
+        w, h = size
+        need = max(min(self.width / w, self.height / h), min(self.width / h, self.height / w))
+        for factor, flag in reduced_flags:
+            if factor * need <= 1:
+                return flag
+        return cv2.IMREAD_COLOR
+
+    def decode(self, data):
+        size = jpeg_size(data)
+        flags = cv2.IMREAD_COLOR if size is None else self.decode_flags(size)
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+    def read(self, img_path):
+        if not self.reduced_decode:
+            return imread(img_path)
+        return self.decode(zipsource.read_bytes(img_path))
+
+    def probe(self, files):
+        # 同几张图分别完整解码和缩小解码，用耗时比估计解码加速
+        full = reduced = 0.0
+        for img_path in files:
+            data = zipsource.read_bytes(img_path)
+            start = time.perf_counter()
+            cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            full += time.perf_counter() - start
+            start = time.perf_counter()
+            self.decode(data)
+            reduced += time.perf_counter() - start
+        n = max(1, len(files))
+        return {"full_ms": round(full / n * 1000, 2), "reduced_ms": round(reduced / n * 1000, 2),
+                "speedup": round(full / reduced, 2) if reduced > 0 else None}
+
+    def load(self, img_path):
+        #print(img_path)
+        return self(self.read(img_path))
+
+    def load_into(self, images, item):
+        i, img_path = item
+        self(self.read(img_path), images[i])
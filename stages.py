@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+# 转换&打包的增量执行: 每个阶段记录输入指纹和输出指纹，
+# 再次执行时输入没变、输出也没被改动的阶段直接跳过
+
+import os
+import json
+import hashlib
+import tempfile
+import stats
+import zipsource
+
+
+def fingerprint(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def path_key(path):
+    # 文件用 大小|修改时间，压缩包内文件用 大小|CRC|时间，目录逐个文件记录，不存在的路径记为 None
+    if zipsource.is_member(path):
+        return zipsource.stat_key(path) if zipsource.exists(path) else None
+    if os.path.isdir(path):
+        keys = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for file in sorted(files):
+                abs_path = os.path.join(root, file)
+                keys.append(f"{os.path.relpath(abs_path, path)}|{zipsource.stat_key(abs_path)}")
+        return fingerprint(keys)
+    if os.path.exists(path):
+        return zipsource.stat_key(path)
+    return None
+
+
+def files_key(files):
+    return fingerprint([f"{f}|{zipsource.stat_key(f)}" for f in files])
+
+
+class StageGraph:
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.state = {}
+        if os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def run(self, name, inputs, fn, outputs=lambda result: []):
+        # inputs: 可 json 序列化的输入描述(含上游阶段的结果)；fn() 的返回值也需可序列化，跳过时直接返回上次的结果
+        # outputs(result): 该阶段产生的路径，被删除或修改时即使输入没变也重新执行
+        key = fingerprint(inputs)
+        old = self.state.get(name)
+        if old is not None and old["inputs"] == key:
+            if fingerprint([path_key(p) for p in outputs(old["result"])]) == old["outputs"]:
+                with stats.stage(name, skipped=True):
+                    pass
+                print(f"[{name}] up to date")
+                return old["result"]
+
+        result = fn()
+        self.state[name] = {
+            "inputs": key,
+            "outputs": fingerprint([path_key(p) for p in outputs(result)]),
+            "result": result,
+        }
+        self.save()
+        return result
+
+    def save(self):
+        # 每个阶段完成后立即保存，中途失败时已完成的阶段下次仍可跳过
+        state_dir = os.path.dirname(os.path.abspath(self.state_path))
+        os.makedirs(state_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=state_dir, suffix=".tmp")
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=4)
+        os.replace(tmp, self.state_path)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+
+# 当前这次转换的统计，未开始时 stage() 不做记录
+_run = None
+# 进度事件的接收函数，例如界面子进程中的 queue.put
+_listener = None
+
+
+def peak_rss():
+    # 进程内存峰值，单位字节
+    if sys.platform.startswith("linux"):
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize
+    import resource
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def reset_peak():
+    # 只有linux能清零峰值，其它平台记录的是到目前为止的最高值
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+class RunStats:
+    def __init__(self, profile=""):
+        self.stages = []
+        self._local = threading.local()
+        # 所有线程的未结束阶段: (线程id, 阶段)
+        self._active = []
+        self._lock = threading.Lock()
+        self.profile = profile
+        self.profiler = None
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        if profile == "cprofile":
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif profile == "tracemalloc":
+            import tracemalloc
+            tracemalloc.start()
+        elif profile:
+            raise ValueError(f"unknown profile: {profile}")
+
+    @property
+    def open(self):
+        # 每个线程各自的未结束阶段，例如模型导入与标定解码同时进行时
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        # 进入子阶段前把当前峰值记到所有未结束的阶段，再清零峰值。
+        # 峰值是整个进程的，其他线程还有未结束的阶段时(例如模型导入与标定同时进行)不清零，
+        # 否则会丢掉它们的峰值，此时子阶段记录的峰值可能偏高
+        entry = {"name": name, **info, "start_s": round(time.perf_counter() - self.wall, 4), "peak_rss": 0}
+        thread = threading.get_ident()
+        with self._lock:
+            hw = peak_rss()
+            for _, parent in self._active:
+                parent["peak_rss"] = max(parent["peak_rss"], hw)
+            if all(t == thread for t, _ in self._active):
+                reset_peak()
+            self._active.append((thread, entry))
+        self.open.append(entry)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield entry
+        finally:
+            entry["wall_s"] = round(time.perf_counter() - wall, 4)
+            entry["cpu_s"] = round(time.process_time() - cpu, 4)
+            with self._lock:
+                entry["peak_rss"] = max(entry["peak_rss"], peak_rss())
+                self._active = [(t, e) for t, e in self._active if e is not entry]
+            self.open.pop()
+            for parent in self.open:
+                parent["peak_rss"] = max(parent["peak_rss"], entry["peak_rss"])
+            self.stages.append(entry)
+            print(f"[{name}] {entry['wall_s']:.2f}s wall, {entry['cpu_s']:.2f}s cpu, "
+                  f"{entry['peak_rss'] / 2**20:.0f} MB peak")
+
+    def save(self, path):
+        stages = sorted(self.stages, key=lambda e: e["start_s"])
+        for entry in stages:
+            entry["peak_rss_mb"] = round(entry.pop("peak_rss") / 2**20, 1)
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "wall_s": round(time.perf_counter() - self.wall, 4),
+            "cpu_s": round(time.process_time() - self.cpu, 4),
+            "peak_rss_mb": max([e["peak_rss_mb"] for e in stages] or [0]),
+            "stages": stages,
+        }
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            prof_path = os.path.splitext(path)[0] + ".prof"
+            self.profiler.dump_stats(prof_path)
+            report["profile"] = prof_path
+        elif self.profile == "tracemalloc":
+            import tracemalloc
+            snapshot = tracemalloc.take_snapshot()
+            _, traced_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report["tracemalloc_peak_mb"] = round(traced_peak / 2**20, 1)
+            report["tracemalloc_top"] = [
+                {"where": str(s.traceback), "size_mb": round(s.size / 2**20, 2), "count": s.count}
+                for s in snapshot.statistics("lineno")[:20]
+            ]
+
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(f"报告: {path}")
+        return report
+
+
+def begin(profile=""):
+    global _run
+    _run = RunStats(profile)
+    return _run
+
+
+def set_listener(fn):
+    global _listener
+    _listener = fn
+
+
+def emit(event, **info):
+    if _listener is not None:
+        _listener({"event": event, **info})
+
+
+def progress(name, done, total=None, **info):
+    emit("progress", stage=name, done=done, total=total, **info)
+
+
+@contextlib.contextmanager
+def _notify(name, ctx):
+    emit("stage", name=name, state="start")
+    with ctx as entry:
+        yield entry
+    emit("stage", name=name, state="end", wall_s=entry.get("wall_s"))
+
+
+def discard():
+    # 丢弃没有保存的统计，例如上一次转换中途失败
+    global _run
+    _run = None
+
+
+def stage(name, **info):
+    if _run is None:
+        ctx = contextlib.nullcontext(dict(info))
+    else:
+        ctx = _run.stage(name, **info)
+    return ctx if _listener is None else _notify(name, ctx)
+
+
+def save(path):
+    global _run
+    if _run is None:
+        return None
+    report = _run.save(path)
+    _run = None
+    return report
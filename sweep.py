@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import copy
+import json
+import time
+import random
+import argparse
+import itertools
+import traceback
+import toml
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import convertor
+
+
+def load_grid(grid_file):
+    # [sweep.grid] 中每个键为 "段.选项"，值为候选列表，取笛卡尔积
+    with open(grid_file, 'r', encoding='utf-8') as f:
+        sweep_conf = toml.load(f).get("sweep", {})
+    grid = sweep_conf.get("grid", {})
+    keys = sorted(grid)
+    variants = []
+    for values in itertools.product(*(grid[k] for k in keys)):
+        overrides = dict(zip(keys, values))
+        name = ",".join(f"{k.split('.')[-1]}={v}" for k, v in overrides.items()) or "base"
+        variants.append((name, overrides))
+    return sweep_conf, variants
+
+
+def apply_overrides(conf, overrides):
+    conf = copy.deepcopy(conf)
+    for key, value in overrides.items():
+        section, option = key.split(".", 1)
+        conf.setdefault(section, {})[option] = value
+    return conf
+
+
+def float_inputs(conf, images):
+    # 把 kmodel 的 uint8 输入换算成 onnx 的浮点输入: 布局、通道顺序、input_range、mean/std
+    import numpy as np
+    opts = conf['compile_options']
+    x = images.astype(np.float32)
+    if opts.get('input_layout', "NCHW") == "NHWC":
+        x = x.transpose(0, 3, 1, 2)
+    if opts.get('swapRB', False):
+        x = x[:, ::-1]
+    r0, r1 = opts.get('input_range', [0, 1])
+    x = x / 255.0 * (r1 - r0) + r0
+    mean = np.array(opts.get('mean', [0, 0, 0]), dtype=np.float32).reshape(1, 3, 1, 1)
+    std = np.array(opts.get('std', [1, 1, 1]), dtype=np.float32).reshape(1, 3, 1, 1)
+    return np.ascontiguousarray((x - mean) / std, dtype=np.float32)
+
+
+def float_reference(onnx_file, conf, holdout):
+    # 浮点参考输出需要 onnxruntime，未安装时不计算误差
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        print("onnxruntime not installed, skip output error")
+        return None
+    import zipsource
+    session = ort.InferenceSession(zipsource.read_bytes(onnx_file), providers=["CPUExecutionProvider"])
+    name = session.get_inputs()[0].name
+    return [session.run(None, {name: float_inputs(conf, sample)}) for sample in holdout]
+
+
+def output_error(outputs, refs):
+    import numpy as np
+    cos, mae = [], []
+    for out, ref in zip(outputs, refs):
+        a = np.concatenate([o.ravel() for o in out]).astype(np.float64)
+        b = np.concatenate([r.ravel() for r in ref]).astype(np.float64)
+        cos.append(float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-12)))
+        mae.append(float(np.abs(a - b).mean()))
+    return {"cosine": round(sum(cos) / len(cos), 6), "mae": round(sum(mae) / len(mae), 6)}
+
+
+def simulate(kmodel, holdout):
+    # 在 nncase 模拟器上运行，返回输出和平均耗时
+    nncase = convertor.load_nncase()
+    sim = nncase.Simulator()
+    with open(kmodel, 'rb') as f:
+        sim.load_model(f.read())
+    outputs, seconds = [], 0.0
+    for sample in holdout:
+        sim.set_input_tensor(0, nncase.RuntimeTensor.from_numpy(sample))
+        start = time.perf_counter()
+        sim.run()
+        seconds += time.perf_counter() - start
+        outputs.append([sim.get_output_tensor(i).to_numpy() for i in range(sim.outputs_size)])
+    return outputs, seconds / max(1, len(holdout))
+
+
+def run_variant(name, overrides, onnx_file, base_conf, calib_file, holdout_file, refs, out_dir):
+    import numpy as np
+    result = {"name": name, "overrides": overrides}
+    try:
+        conf = apply_overrides(base_conf, overrides)
+        safe = "".join(c if c.isalnum() or c in "=-_" else "_" for c in name)
+        conf_file = os.path.join(out_dir, safe + ".toml")
+        kmodel = os.path.join(out_dir, safe + ".kmodel")
+        with open(conf_file, 'w') as f:
+            toml.dump(conf, f)
+
+        calib = np.load(calib_file, mmap_mode='r')
+        start = time.perf_counter()
+        c = convertor.Convertor(onnx_file, kmodel, conf_file, [calib])
+        c.convert()
+        c = None
+        result["compile_s"] = round(time.perf_counter() - start, 2)
+        result["kmodel_kb"] = round(os.path.getsize(kmodel) / 1024, 1)
+
+        holdout = np.load(holdout_file)
+        outputs, sim_s = simulate(kmodel, holdout)
+        result["sim_ms"] = round(sim_s * 1000, 2)
+        if refs is not None:
+            result.update(output_error(outputs, refs))
+        result["ok"] = True
+    except Exception as e:
+        traceback.print_exc()
+        result["ok"] = False
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def prepare_data(onnx_file, dataset, base_conf, out_dir, holdout, seed=0):
+    # 从标定集之外留出若干图片，用于模拟器计时和误差评估；标定张量保存为 calib.npy 供各次编译共用
+    import numpy as np
+    import calib_select
+    calib_conf = base_conf.setdefault("calib_options", {})
+    files = convertor.list_files(dataset)
+    random.Random(seed).shuffle(files)
+    holdout_count = min(int(holdout), max(1, len(files) // 5))
+    holdout_files, files = sorted(files[:holdout_count]), sorted(files[holdout_count:])
+    files = calib_select.dedupe(files, calib_conf, convertor.calib_workers(calib_conf))
+    files = calib_select.select_files(files, calib_conf, convertor.calib_workers(calib_conf))
+
+    calib, memmap_path = convertor.build_calib(files, base_conf, dataset)
+    calib_file = os.path.join(out_dir, "calib.npy")
+    np.save(calib_file, calib)
+    calib = None
+    if memmap_path is not None:
+        os.remove(memmap_path)
+
+    holdout_conf = apply_overrides(base_conf, {"calib_options.tensor_cache": False})
+    holdout, memmap_path = convertor.build_calib(holdout_files, holdout_conf, dataset)
+    holdout_file = os.path.join(out_dir, "holdout.npy")
+    np.save(holdout_file, holdout)
+    holdout = None
+    if memmap_path is not None:
+        os.remove(memmap_path)
+    refs = float_reference(onnx_file, base_conf, np.load(holdout_file))
+    return calib_file, holdout_file, refs, len(files), len(holdout_files)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile a grid of ptq/compile option variants in parallel")
+    parser.add_argument("grid", help="toml file with [sweep] and [sweep.grid]")
+    parser.add_argument("--onnx", required=True, help="best.onnx, may be inside a zip: model.zip/best.onnx")
+    parser.add_argument("--dataset", required=True, help="images/train, may be inside a zip")
+    parser.add_argument("--kmodel-conf", default="kmodel_conf.toml")
+    parser.add_argument("--out-dir", default="sweep_out")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="parallel compilations")
+    args = parser.parse_args(argv)
+
+    sweep_conf, variants = load_grid(args.grid)
+    base_conf = convertor.load_conf(args.kmodel_conf)
+    os.makedirs(args.out_dir, exist_ok=True)
+    calib_file, holdout_file, refs, calib_count, holdout_count = prepare_data(
+        args.onnx, args.dataset, base_conf, args.out_dir, sweep_conf.get("holdout", 8), sweep_conf.get("seed", 0))
+
+    jobs = args.jobs or sweep_conf.get("workers", 2)
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(run_variant, name, overrides, args.onnx, base_conf,
+                                   calib_file, holdout_file, refs, args.out_dir)
+                   for name, overrides in variants]
+        for fut in as_completed(futures):
+            r = fut.result()
+            results.append(r)
+            print(f"{'OK  ' if r['ok'] else 'FAIL'} {r['name']}")
+
+    results.sort(key=lambda r: (not r["ok"], r.get("sim_ms", 0)))
+    report_path = os.path.join(args.out_dir, "sweep.json")
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({"calib_images": calib_count, "holdout_images": holdout_count, "variants": results},
+                  f, ensure_ascii=False, indent=4)
+
+    print(f"\n{'variant':<60} {'compile_s':>9} {'kmodel_kb':>10} {'sim_ms':>8} {'cosine':>8} {'mae':>8}")
+    for r in results:
+        if not r["ok"]:
+            print(f"{r['name']:<60} {r['error']}")
+            continue
+        print(f"{r['name']:<60} {r['compile_s']:>9} {r['kmodel_kb']:>10} {r['sim_ms']:>8} "
+              f"{r.get('cosine', '-'):>8} {r.get('mae', '-'):>8}")
+    print(f"报告: {report_path}")
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
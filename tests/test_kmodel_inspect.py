@@ -0,0 +1,90 @@
+# cpu_conv.kmodel: nncase 2.10 以 target = "cpu" 编译的 Conv+Relu，整个模型都在 CPU 上
+
+import os
+import sys
+import struct
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kmodel_inspect
+
+fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cpu_conv.kmodel")
+
+
+def write(tmp_path, data, name="model.kmodel"):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def module(kind, functions, sections):
+    # 按 kmodel v7 布局拼一个模块: 函数只有头，段内容为 body_size 个 0
+    body = b""
+    for _ in range(functions):
+        body += kmodel_inspect.function_header.pack(1, 0, 0, 0, kmodel_inspect.function_header.size)
+    for name, body_size in sections:
+        size = kmodel_inspect.section_header.size + body_size
+        body += kmodel_inspect.section_header.pack(name.encode(), 0, 0, size, 0, body_size, body_size) + bytes(body_size)
+    size = kmodel_inspect.module_header.size + len(body)
+    return kmodel_inspect.module_header.pack(kind.encode(), 1, len(sections), functions, 0, size) + body
+
+
+def kmodel(*modules):
+    header = kmodel_inspect.model_header.pack(kmodel_inspect.kmodel_identifier, kmodel_inspect.kmodel_version,
+                                              0, 8, len(modules), 0, 0, 0)
+    return header + b"".join(modules)
+
+
+def test_cpu_fixture():
+    report = kmodel_inspect.inspect(fixture)
+    assert not report["partial"]
+    assert report["version"] == 7
+    assert [m["kind"] for m in report["modules"]] == ["stackvm"]
+    s = report["summary"]
+    assert s["file_size"] == os.path.getsize(fixture)
+    assert s["functions_by_kind"] == {"stackvm": 1}
+    assert s["rdata_bytes"] == s["sections"]["stackvm.rdata"] > 0
+    assert s["sections"]["stackvm.text"] > 0
+
+
+def test_all_cpu_model_fails_threshold():
+    report = kmodel_inspect.inspect(fixture)
+    assert report["summary"]["cpu_fallback_functions"] == 1
+    with pytest.raises(RuntimeError):
+        kmodel_inspect.check(report, 0)
+    kmodel_inspect.check(report, 1)
+    kmodel_inspect.check(report, -1)
+
+
+def test_entry_function_not_counted_with_kpu(tmp_path):
+    path = write(tmp_path, kmodel(module("stackvm", 1, [(".text", 16)]),
+                                  module("k230", 3, [(".text", 64), (".rdata", 128)])))
+    report = kmodel_inspect.inspect(path)
+    assert not report["partial"]
+    assert report["summary"]["functions_by_kind"] == {"stackvm": 1, "k230": 3}
+    assert report["summary"]["cpu_fallback_functions"] == 0
+    assert report["summary"]["rdata_bytes"] == 128
+    kmodel_inspect.check(report, 0)
+
+
+def test_truncated_is_partial_and_refuses_threshold(tmp_path):
+    with open(fixture, 'rb') as f:
+        data = f.read()
+    report = kmodel_inspect.inspect(write(tmp_path, data[:len(data) // 2]))
+    assert report["partial"]
+    with pytest.raises(RuntimeError):
+        kmodel_inspect.check(report, 5)
+    kmodel_inspect.check(report, -1)
+
+
+def test_other_version_is_partial(tmp_path):
+    data = bytearray(kmodel(module("stackvm", 1, [(".text", 16)])))
+    struct.pack_into("<I", data, 4, 6)
+    report = kmodel_inspect.inspect(write(tmp_path, bytes(data)))
+    assert report["partial"] and report["modules"] == []
+
+
+def test_not_a_kmodel(tmp_path):
+    with pytest.raises(ValueError):
+        kmodel_inspect.inspect(write(tmp_path, b"KMDL" + bytes(60)))
@@ -0,0 +1,47 @@
+import os
+import sys
+import json
+import struct
+import hashlib
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pipeline
+
+local_header = struct.Struct("<4s5H3L2H")  # signature, version, flags, method, time, date, crc, csize, size, name_len, extra_len
+
+
+def make_output(path):
+    os.makedirs(path / "model_output")
+    files = {
+        "app.kmodel": os.urandom(200_000),
+        "icon.png": os.urandom(5_000),
+        "conf.json": json.dumps({"conf": {"fps_limit": 15}}, indent=4).encode() * 50,
+        "app.dfrobot_test": b"",
+    }
+    for name, data in files.items():
+        (path / "model_output" / name).write_bytes(data)
+    return files
+
+
+def test_package_reopens_without_data_descriptors(tmp_path):
+    files = make_output(tmp_path)
+    package = pipeline.zip_with_md5(str(tmp_path / "model_output"), str(tmp_path), "app")
+
+    with open(package, 'rb') as f:
+        data = f.read()
+    assert os.path.basename(package) == f"app.{hashlib.md5(data).hexdigest()[:4]}.zip"
+
+    with zipfile.ZipFile(package) as z:
+        assert z.testzip() is None
+        assert sorted(z.namelist()) == sorted(files)
+        for info in z.infolist():
+            assert z.read(info) == files[info.filename]
+            assert info.flag_bits & 0x08 == 0
+            # 流式解压只看本地文件头，CRC 和大小必须已经写在里面
+            sig, _, flags, method, _, _, crc, csize, size, _, _ = local_header.unpack_from(data, info.header_offset)
+            assert sig == b"PK\x03\x04" and flags & 0x08 == 0
+            assert (method, crc, csize, size) == (info.compress_type, info.CRC, info.compress_size, info.file_size)
+        assert z.getinfo("app.kmodel").compress_type == zipfile.ZIP_STORED
+        assert z.getinfo("icon.png").compress_type == zipfile.ZIP_STORED
+        assert z.getinfo("conf.json").compress_type == zipfile.ZIP_DEFLATED
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# 常驻转换服务: 进程池中的 worker 预先加载 nncase，任务通过本地 socket 提交，
+# 省去每次转换加载 nncase/.NET/k230 插件的时间。worker 处理 max_jobs 个任务后重启，避免内存持续增长
+
+import os
+import sys
+import json
+import time
+import secrets
+import argparse
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Listener, Client
+
+import stats
+import zipsource
+import convertor
+
+default_address = "127.0.0.1:6230"
+default_key_file = os.path.join("~", ".onnx2kmodel", "worker.key")
+
+
+def worker_options(kmodel_conf="kmodel_conf.toml"):
+    if not os.path.exists(kmodel_conf):
+        return {}
+    return convertor.load_conf(kmodel_conf).get('worker_options', {})
+
+
+def load_authkey(opts):
+    # 连接上收到的对象会被反序列化，密钥不能是公开的固定值。
+    # 未配置 authkey 时使用当前用户目录下首次运行时随机生成的密钥，只有同一用户的 serve/submit 能连接
+    if opts.get('authkey'):
+        return opts['authkey'].encode()
+    path = os.path.expanduser(opts.get('authkey_file') or default_key_file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    except FileExistsError:
+        pass
+    with open(path, 'r') as f:
+        return f.read().strip().encode()
+
+
+def parse_address(address):
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+def warm_up(kmodel_conf):
+    # 进程池 initializer: 加载 nncase 并创建一次编译器，让 .NET 运行时和插件提前就绪
+    start = time.perf_counter()
+    try:
+        nncase = convertor.load_nncase()
+        compile_options = nncase.CompileOptions()
+        compile_options.target = convertor.load_conf(kmodel_conf)['compile_options']['target']
+        nncase.Compiler(compile_options)
+    except Exception as e:
+        print(f"warm up compiler failed: {e}")
+    print(f"worker {os.getpid()} ready in {time.perf_counter() - start:.2f}s")
+
+
+def run_request(req):
+    # 每个任务都新建 Convertor，只复用已加载的 nncase
+    start = time.time()
+    result = {"id": req.get("id"), "pid": os.getpid()}
+    # 上一个任务失败时可能留下未保存的统计和已打开的压缩包
+    stats.discard()
+    zipsource.close_all()
+    kmodel_conf = req.get("kmodel_conf", "kmodel_conf.toml")
+    try:
+        import cli
+        import pipeline
+        if req["kind"] == "make":
+            stats.begin()
+            convertor.make(req["onnx"], req["kmodel"], req["dataset"], kmodel_conf)
+            report = stats.save(os.path.splitext(req["kmodel"])[0] + ".report.json")
+            result.update(ok=True, kmodel=req["kmodel"], stages=report["stages"])
+        else:
+            job = req["job"]
+            result.update(cli.run_job(job, kmodel_conf, req["work_dir"], req["zip_dir"]))
+            if result["ok"]:
+                result["kmodel"] = os.path.join(req["work_dir"], job["name"], "model_output",
+                                                pipeline.app_id(job) + ".kmodel")
+                report_path = os.path.splitext(result["package"])[0] + ".report.json"
+                if os.path.exists(report_path):
+                    with open(report_path, 'r', encoding='utf-8') as f:
+                        result["stages"] = json.load(f)["stages"]
+    except Exception as e:
+        traceback.print_exc()
+        result.update(ok=False, error=f"{type(e).__name__}: {e}")
+    result["seconds"] = round(time.time() - start, 1)
+    return result
+
+
+class WorkerPool:
+    # worker 进程异常退出时 ProcessPoolExecutor 让未完成的任务抛出 BrokenProcessPool，
+    # 不会像 multiprocessing.Pool 那样一直等待；池损坏后下一个任务提交时重建。
+    # 每个 worker 平均处理 max_jobs 个任务后整个池重建，与 Python 版本无关(max_tasks_per_child 需要 3.11)
+    def __init__(self, workers, kmodel_conf, max_jobs):
+        self.workers = workers
+        self.kmodel_conf = kmodel_conf
+        self.max_jobs = max_jobs
+        self.lock = threading.Lock()
+        self.executor = self.create()
+
+    def create(self):
+        self.jobs = 0
+        return ProcessPoolExecutor(self.workers, initializer=warm_up, initargs=(self.kmodel_conf,))
+
+    def submit(self, fn, *args):
+        with self.lock:
+            if self.jobs >= self.max_jobs * self.workers:
+                # 等正在执行的任务结束后重启，释放 nncase 累积的内存
+                print(f"recycling workers after {self.jobs} jobs")
+                self.executor.shutdown(wait=True)
+                self.executor = self.create()
+            try:
+                future = self.executor.submit(fn, *args)
+            except BrokenProcessPool:
+                print("worker pool broken, restarting")
+                self.executor.shutdown(wait=False)
+                self.executor = self.create()
+                future = self.executor.submit(fn, *args)
+            self.jobs += 1
+            return future
+
+    def shutdown(self):
+        with self.lock:
+            self.executor.shutdown(wait=True)
+
+
+def handle(conn, pool, stop):
+    # 一个连接上可以连续提交多个任务，结果按完成先后返回，用 id 对应
+    lock = threading.Lock()
+
+    def reply(result):
+        with lock:
+            try:
+                conn.send(result)
+            except OSError:
+                pass
+
+    try:
+        while True:
+            req = conn.recv()
+            if req.get("kind") == "shutdown":
+                stop.set()
+                reply({"id": req.get("id"), "ok": True})
+                return
+            # worker 异常退出(BrokenProcessPool)等情况也要回复，否则客户端会一直等待
+            def done(future, _id=req.get("id")):
+                e = future.exception()
+                reply(future.result() if e is None else {"id": _id, "ok": False, "error": f"{type(e).__name__}: {e}"})
+
+            try:
+                pool.submit(run_request, req).add_done_callback(done)
+            except Exception as e:
+                reply({"id": req.get("id"), "ok": False, "error": f"{type(e).__name__}: {e}"})
+    except EOFError:
+        pass
+
+
+def serve(args):
+    opts = worker_options(args.kmodel_conf)
+    address = parse_address(args.address or opts.get('address', default_address))
+    workers = args.workers or opts.get('workers', 1)
+    max_jobs = args.max_jobs or opts.get('max_jobs', 20)
+    authkey = load_authkey(opts)
+
+    pool = WorkerPool(workers, args.kmodel_conf, max_jobs)
+    stop = threading.Event()
+    listener = Listener(address, authkey=authkey)
+    print(f"listening on {address[0]}:{address[1]}, {workers} workers, recycle after {max_jobs} jobs")
+
+    def accept():
+        while not stop.is_set():
+            try:
+                conn = listener.accept()
+            except OSError:
+                break
+            threading.Thread(target=handle, args=(conn, pool, stop), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
+    listener.close()
+    # 等正在执行的任务结束
+    pool.shutdown()
+    return 0
+
+
+def connect(args):
+    opts = worker_options(args.kmodel_conf or "kmodel_conf.toml")
+    address = parse_address(args.address or opts.get('address', default_address))
+    return Client(address, authkey=load_authkey(opts))
+
+
+def submit(args):
+    import cli
+    _conf, jobs = cli.load_jobs(args.manifest)
+    kmodel_conf = os.path.abspath(args.kmodel_conf or _conf.get("kmodel_conf", "kmodel_conf.toml"))
+    work_dir = os.path.abspath(args.work_dir or _conf.get("work_dir", "build"))
+    zip_dir = os.path.abspath(args.output_dir or _conf.get("output_dir", "./"))
+    os.makedirs(work_dir, exist_ok=True)
+    os.makedirs(zip_dir, exist_ok=True)
+
+    with connect(args) as conn:
+        for i, job in enumerate(jobs):
+            conn.send({"id": i, "kind": "export", "job": job, "kmodel_conf": kmodel_conf,
+                       "work_dir": work_dir, "zip_dir": zip_dir})
+        results = [None] * len(jobs)
+        for _ in jobs:
+            r = conn.recv()
+            # worker 异常退出时的回复只有 id 和 error
+            r.setdefault("name", jobs[r["id"]]["name"])
+            results[r["id"]] = r
+            print(f"{'OK  ' if r['ok'] else 'FAIL'} {r['name']} ({r.get('seconds', '-')}s, worker {r.get('pid', '-')})")
+            if not r["ok"]:
+                print(f"    {r['error']}")
+            for entry in r.get("stages", []):
+                print(f"    {entry['name']:<12} {entry['wall_s']:8.2f}s")
+
+    failed = [r for r in results if not r["ok"]]
+    print(f"\n{len(results) - len(failed)} succeeded, {len(failed)} failed")
+    if args.summary:
+        with open(args.summary, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=4)
+    return 1 if failed else 0
+
+
+def make(args):
+    # 路径在服务端解析，这里统一转成绝对路径
+    with connect(args) as conn:
+        conn.send({"id": 0, "kind": "make", "onnx": os.path.abspath(args.onnx),
+                   "kmodel": os.path.abspath(args.kmodel), "dataset": os.path.abspath(args.dataset),
+                   "kmodel_conf": os.path.abspath(args.kmodel_conf)})
+        r = conn.recv()
+    print(json.dumps(r, ensure_ascii=False, indent=4))
+    return 0 if r["ok"] else 1
+
+
+def shutdown(args):
+    with connect(args) as conn:
+        conn.send({"id": 0, "kind": "shutdown"})
+        conn.recv()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep nncase loaded in a worker pool and convert jobs sent over a local socket")
+    parser.add_argument("--address", default=None, help=f"host:port, default: worker_options.address or {default_address}")
+    sub = parser.add_subparsers(dest="cmd")
+    p = sub.add_parser("serve")
+    p.add_argument("--kmodel-conf", default="kmodel_conf.toml")
+    p.add_argument("-w", "--workers", type=int, default=None, help="worker processes, default: worker_options.workers")
+    p.add_argument("--max-jobs", type=int, default=None, help="restart a worker after this many jobs")
+    p = sub.add_parser("submit")
+    p.add_argument("manifest", help="app_conf.toml or a manifest with [[jobs]], same as cli.py")
+    p.add_argument("--kmodel-conf", default=None)
+    p.add_argument("--work-dir", default=None)
+    p.add_argument("--output-dir", default=None)
+    p.add_argument("--summary", default=None)
+    p = sub.add_parser("make")
+    p.add_argument("onnx")
+    p.add_argument("kmodel")
+    p.add_argument("dataset")
+    p.add_argument("--kmodel-conf", default="kmodel_conf.toml")
+    p = sub.add_parser("shutdown")
+    p.add_argument("--kmodel-conf", default="kmodel_conf.toml")
+    args = parser.parse_args(argv)
+
+    commands = {"serve": serve, "submit": submit, "make": make, "shutdown": shutdown}
+    if args.cmd not in commands:
+        parser.print_help()
+        return 1
+    return commands[args.cmd](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# 把 zip 包内的文件当作普通路径使用，例如 dataset.zip/images/train/x.jpg
+# 标定时直接从压缩包读取，不再先解压到 model_input
+
+import os
+import threading
+import functools
+import zipfile
+
+_lock = threading.Lock()
+_archives = {}
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def split(path):
+    # 返回 (zip文件, 包内路径)，普通文件返回 None
+    path = os.path.normpath(str(path))
+    if os.path.exists(path):
+        return None
+    head, inner = path, []
+    while True:
+        parent, name = os.path.split(head)
+        if not name:
+            return None
+        inner.insert(0, name)
+        head = parent
+        if head.lower().endswith(".zip") and os.path.isfile(head):
+            return head, "/".join(inner)
+
+
+def join(zip_path, inner):
+    return os.path.join(zip_path, *inner.split("/"))
+
+
+def archive(zip_path):
+    # 每个进程每个压缩包只打开一次，zipfile 读取时自带锁，可在线程间共享
+    with _lock:
+        zip_ref = _archives.get(zip_path)
+        if zip_ref is None:
+            zip_ref = zipfile.ZipFile(zip_path, 'r')
+            _archives[zip_path] = zip_ref
+        return zip_ref
+
+
+def close_all():
+    with _lock:
+        for zip_ref in _archives.values():
+            zip_ref.close()
+        _archives.clear()
+    split.cache_clear()
+
+
+def is_member(path):
+    return split(path) is not None
+
+
+def exists(path):
+    loc = split(path)
+    if loc is None:
+        return os.path.exists(path)
+    try:
+        archive(loc[0]).getinfo(loc[1])
+        return True
+    except KeyError:
+        return False
+
+
+def list_files(path):
+    # path 为压缩包本身或包内目录
+    if os.path.isfile(path) and str(path).lower().endswith(".zip"):
+        zip_path, prefix = str(path), ""
+    else:
+        zip_path, prefix = split(path)
+        prefix = prefix.rstrip("/") + "/"
+    return [join(zip_path, info.filename) for info in archive(zip_path).infolist()
+            if not info.is_dir() and info.filename.startswith(prefix)]
+
+
+def read_bytes(path):
+    loc = split(path)
+    if loc is None:
+        with open(path, 'rb') as f:
+            return f.read()
+    return archive(loc[0]).read(loc[1])
+
+
+def open_file(path):
+    loc = split(path)
+    if loc is None:
+        return open(path, 'rb')
+    return archive(loc[0]).open(loc[1])
+
+
+def stat_key(path):
+    # 包内文件用大小+CRC+时间，不需要读取内容
+    loc = split(path)
+    if loc is None:
+        st = os.stat(path)
+        return f"{st.st_size}|{st.st_mtime_ns}"
+    info = archive(loc[0]).getinfo(loc[1])
+    return f"{info.file_size}|{info.CRC:08x}|{info.date_time}"